@@ -0,0 +1,139 @@
+"""Measures the CPU cost of the text preprocessing and its event loop lag.
+
+Times the transcript join (as in local_yt_summary.create_transcript), the
+<think> stripping of a streamed response (reasoning_stream.ThinkStripper) and
+the discussion cleaning for several input sizes. Then runs concurrent
+long-transcript jobs in a thread pool, the way tldw does, and reports the
+event loop lag they cause.
+
+Run from the project directory:
+python benchmarks/preprocessing_loop_lag.py
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wagabotowy"))
+
+import local_discussion_summary as cds
+import reasoning_stream
+
+
+# Transcript segments: ~1 200 per hour of a video
+SEGMENTS = (1200, 4800, 12000, 48000)
+# Discussion messages: 200 is the tldr maximum
+MESSAGES = (50, 200, 1000)
+RESPONSE_TOKENS = 2000
+JOBS = 8
+LAG_SEGMENTS = 48000
+REPEATS = 5
+PROBE_INTERVAL = 0.005
+
+
+def create_transcript(segments):
+    """Creates a transcript in the youtube_transcript_api format."""
+    return [
+        {"text": f"to jest zdanie numer {i} z filmu", "start": i * 3.0, "duration": 3.0}
+        for i in range(segments)
+    ]
+
+
+def join_transcript(transcript):
+    """Joins the transcript like local_yt_summary.create_transcript."""
+    return " ".join([item["text"] for item in transcript])
+
+
+def create_discussion(messages):
+    """Creates a discussion with links, mentions and emojis to clean."""
+    return "\n".join(
+        f"user{i % 7}: wiadomość {i} <@{i}> zobacz https://youtu.be/{i} :{i}> ok"
+        for i in range(messages)
+    )
+
+
+def strip_response(tokens):
+    """Feeds the streamed response with a think block to ThinkStripper."""
+    stripper = reasoning_stream.ThinkStripper()
+    stripper.feed("<think>")
+    for i in range(tokens):
+        stripper.feed(" myśl" if i < tokens // 2 else " odpowiedź")
+        if i == tokens // 2:
+            stripper.feed("</think>")
+    return stripper.flush()
+
+
+def measure(function, data):
+    """Returns the average time of the function in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        function(data)
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+
+def calibrate():
+    """Prints the time of every preprocessing step."""
+    for segments in SEGMENTS:
+        transcript = create_transcript(segments)
+        print(
+            f"transcript join  {segments:>6} segments: "
+            f"{measure(join_transcript, transcript):7.2f} ms"
+        )
+    for messages in MESSAGES:
+        discussion = create_discussion(messages)
+        print(
+            f"discussion clean {messages:>6} messages: "
+            f"{measure(cds.clean_discussion_string, discussion):7.2f} ms"
+        )
+    print(
+        f"think stripping  {RESPONSE_TOKENS:>6} tokens:   "
+        f"{measure(strip_response, RESPONSE_TOKENS):7.2f} ms"
+    )
+
+
+def transcript_job(transcript):
+    """Preprocesses a long transcript and the model response."""
+    join_transcript(transcript)
+    strip_response(RESPONSE_TOKENS)
+
+
+async def measure_lag(stop_event):
+    """Returns the list of event loop scheduling delays."""
+    lags = []
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+    return lags
+
+
+async def run():
+    """Runs concurrent long-transcript jobs in threads and reports the loop lag."""
+    transcript = create_transcript(LAG_SEGMENTS)
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    probe = asyncio.create_task(measure_lag(stop_event))
+    await asyncio.sleep(PROBE_INTERVAL * 2)
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(executor, transcript_job, transcript)
+                for _ in range(JOBS)
+            )
+        )
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    lags = sorted(await probe)
+    print(
+        f"{JOBS} jobs x {LAG_SEGMENTS} segments | total: {elapsed * 1000:.1f} ms | "
+        f"probes: {len(lags)} | lag p50: {lags[len(lags) // 2] * 1000:.1f} ms | "
+        f"lag max: {lags[-1] * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    calibrate()
+    asyncio.run(run())
@@ -0,0 +1,97 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import discussion_index as di
+
+
+MODEL = "test-embedding"
+
+
+def fake_embed(texts):
+    """Embeds texts as normalized vectors depending on the first letter."""
+    vectors = np.zeros((len(texts), 4), dtype=np.float32)
+    for row, text in enumerate(texts):
+        vectors[row, ord(text[0]) % 4] = 1
+    return vectors
+
+
+@pytest.fixture(autouse=True)
+def offline_embed(monkeypatch):
+    monkeypatch.setattr(di, "embed", fake_embed)
+
+
+def create_index(directory):
+    index = di.ChannelIndex(1, str(directory), MODEL)
+    index.add_messages(
+        [
+            {"id": 1, "author": "a", "content": "alfa"},
+            {"id": 2, "author": "b", "content": "beta"},
+            {"id": 3, "author": "a", "content": "alfa again"},
+        ]
+    )
+    return index
+
+
+def test_loads_saved_index(tmp_path):
+    create_index(tmp_path)
+
+    index = di.ChannelIndex(1, str(tmp_path), MODEL)
+
+    assert index.last_message_id == 3
+    assert [message["id"] for message in index.search("alfa", 10, 0.5)] == [1, 3]
+
+
+def test_rebuilds_index_with_cut_metadata_line(tmp_path):
+    index = create_index(tmp_path)
+    with open(index.messages_path, "rb+") as messages_file:
+        messages_file.truncate(os.path.getsize(index.messages_path) - 5)
+
+    index = di.ChannelIndex(1, str(tmp_path), MODEL)
+
+    assert index.last_message_id is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_rebuilds_index_with_missing_vectors(tmp_path):
+    index = create_index(tmp_path)
+    os.remove(index.vectors_path)
+
+    index = di.ChannelIndex(1, str(tmp_path), MODEL)
+
+    assert index.last_message_id is None
+    assert index.search("alfa", 10, 0.5) == []
+
+
+def test_removes_files_written_before_the_state_file(tmp_path):
+    index = create_index(tmp_path)
+    os.remove(index.state_path)
+
+    index = di.ChannelIndex(1, str(tmp_path), MODEL)
+    index.add_messages([{"id": 4, "author": "a", "content": "alfa"}])
+
+    assert di.ChannelIndex(1, str(tmp_path), MODEL).messages == index.messages
+    assert [message["id"] for message in index.messages] == [4]
+
+
+def test_removed_messages_are_not_found(tmp_path):
+    index = create_index(tmp_path)
+    index.remove_messages([1])
+
+    assert [message["id"] for message in index.search("alfa", 10, 0.5)] == [3]
+    index = di.ChannelIndex(1, str(tmp_path), MODEL)
+    assert [message["id"] for message in index.search("alfa", 10, 0.5)] == [3]
+
+
+def test_skips_bot_commands():
+    bot_user = SimpleNamespace(name="bot")
+    author = SimpleNamespace(name="user")
+    command = SimpleNamespace(
+        id=1, author=author, mentions=[bot_user], content="<@7> tldr pizza"
+    )
+    message = SimpleNamespace(id=2, author=author, mentions=[], content="pizza")
+
+    assert di.to_index_entry(command, bot_user) is None
+    assert di.to_index_entry(message, bot_user)["content"] == "pizza"
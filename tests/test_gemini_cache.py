@@ -0,0 +1,128 @@
+import pytest
+from google.api_core import exceptions
+
+import gemini_cache
+
+
+TRANSCRIPT = "transkrypt " * 100
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def backend(clock):
+    return gemini_cache.FakeGeminiCacheBackend(clock=clock, min_chars=100)
+
+
+@pytest.fixture
+def cache(backend, clock):
+    return gemini_cache.GeminiContextCache(
+        backend, model="fake-model", ttl=100, max_entries=2, max_seen=10, clock=clock
+    )
+
+
+def generate(cache, video_id, transcript=TRANSCRIPT):
+    return cache.generate(video_id, "instrukcja", transcript, "Podsumuj")
+
+
+def test_creates_cache_on_second_request(cache, backend):
+    assert generate(cache, "a") is None
+    assert backend.created == []
+
+    assert generate(cache, "a").startswith("Podsumuj")
+    assert generate(cache, "a").startswith("Podsumuj")
+    assert len(backend.created) == 1
+    assert len(backend.generated) == 2
+
+
+def test_remembers_rejected_create(cache, backend):
+    generate(cache, "short", "za krótki")
+
+    assert generate(cache, "short", "za krótki") is None
+    assert generate(cache, "short", "za krótki") is None
+    assert backend.created == []
+    assert cache.seen[cache.create_key("short", "instrukcja")] == "failed"
+
+
+def test_recreates_cache_not_found_on_server(cache, backend):
+    generate(cache, "a")
+    generate(cache, "a")
+    backend.contents.clear()
+
+    assert generate(cache, "a").startswith("Podsumuj")
+    assert len(backend.created) == 2
+
+
+def test_other_errors_do_not_recreate_cache(cache, backend, monkeypatch):
+    generate(cache, "a")
+    generate(cache, "a")
+
+    def rate_limited(handle, prompt, generation_config):
+        raise exceptions.TooManyRequests("429")
+
+    monkeypatch.setattr(backend, "generate", rate_limited)
+    with pytest.raises(exceptions.TooManyRequests):
+        generate(cache, "a")
+    assert len(backend.created) == 1
+    assert backend.deleted == []
+
+
+def test_refreshes_cache_after_half_ttl(cache, backend, clock):
+    generate(cache, "a")
+    generate(cache, "a")
+
+    clock.now = 40
+    generate(cache, "a")
+    assert backend.refreshed == []
+
+    clock.now = 60
+    generate(cache, "a")
+    assert len(backend.refreshed) == 1
+
+    clock.now = 150
+    assert generate(cache, "a").startswith("Podsumuj")
+    assert len(backend.created) == 1
+
+
+def test_recreates_expired_cache(cache, backend, clock):
+    generate(cache, "a")
+    generate(cache, "a")
+
+    clock.now = 200
+    assert generate(cache, "a").startswith("Podsumuj")
+    assert len(backend.created) == 2
+
+
+def test_evicts_least_recently_used_cache(cache, backend):
+    for video_id in ("a", "b", "a", "b", "c", "c"):
+        generate(cache, video_id)
+
+    first = backend.created[0]
+    assert backend.deleted == [first]
+    assert first not in backend.contents
+    assert [key[0] for key in cache.entries] == ["b", "c"]
+
+
+def test_evict_and_clear_delete_caches(cache, backend):
+    for video_id in ("a", "a", "b", "b"):
+        generate(cache, video_id)
+
+    cache.evict("a")
+    assert backend.deleted == [backend.created[0]]
+    assert [key[0] for key in cache.entries] == ["b"]
+
+    cache.clear()
+    assert backend.deleted == backend.created
+    assert backend.contents == {}
+    assert cache.entries == {}
@@ -0,0 +1,89 @@
+import model_selector
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_requests(selector, clock, times, text, seconds):
+    tiers = []
+    for now in times:
+        clock.now = now
+        choice = selector.select("discussion", text)
+        tiers.append(choice.tier)
+        clock.now = now + seconds[choice.tier]
+        selector.finish(choice, seconds[choice.tier], True)
+    return tiers
+
+
+def test_sparse_requests_stay_on_normal_tier_fitting_slo():
+    clock = Clock()
+    selector = model_selector.ModelSelector(latency_slo=90, clock=clock)
+
+    tiers = run_requests(
+        selector, clock, [0, 1000, 2000, 3000, 4000], "x" * 3000, {"normal": 30, "ez": 10}
+    )
+
+    assert tiers == ["normal"] * 5
+
+
+def test_normal_tier_over_slo_is_probed_once_per_interval():
+    clock = Clock()
+    selector = model_selector.ModelSelector(latency_slo=10, clock=clock)
+    times = [0, 100, 200, 1000, 1100, 1200, 2000]
+
+    tiers = run_requests(selector, clock, times, "x" * 3000, {"normal": 60, "ez": 5})
+
+    assert tiers == ["ez", "ez", "ez", "normal", "ez", "ez", "normal"]
+
+
+def test_probe_moves_back_to_normal_tier_when_it_got_faster():
+    clock = Clock()
+    selector = model_selector.ModelSelector(latency_slo=30, clock=clock)
+    times = [0, 1000, 1100]
+
+    tiers = run_requests(selector, clock, times, "x" * 60000, {"normal": 20, "ez": 5})
+
+    assert tiers == ["ez", "normal", "normal"]
+
+
+def test_samples_age_out():
+    clock = Clock()
+    selector = model_selector.ModelSelector(latency_slo=90, clock=clock)
+    defaults = selector.service_time_model("discussion", "normal")
+    run_requests(selector, clock, [0], "x" * 3000, {"normal": 80, "ez": 10})
+    assert selector.service_time_model("discussion", "normal") != defaults
+
+    clock.now = 10000
+
+    assert selector.service_time_model("discussion", "normal") == defaults
+
+
+def test_queueing_is_counted_once():
+    clock = Clock()
+    selector = model_selector.ModelSelector(latency_slo=1000, clock=clock)
+    first = selector.select("discussion", "x" * 3000)
+    second = selector.select("discussion", "x" * 3000)
+    selector.finish(second, 40, True)
+    selector.finish(first, 20, True)
+
+    assert [sample[2] for sample in selector.samples[("discussion", "normal")]] == [
+        20,
+        20,
+    ]
+
+
+def test_context_covers_system_instruction_and_margin():
+    selector = model_selector.ModelSelector(latency_slo=1000)
+    _, output_tokens, system_instruction = model_selector.TASKS["discussion"]
+    text = "x" * 3 * (2048 - output_tokens)
+
+    choice = selector.select("discussion", text)
+
+    needed = (len(system_instruction) + len(text)) / 2.5 + output_tokens
+    assert choice.num_ctx >= needed
+    assert choice.num_ctx == 4096
@@ -1,18 +1,52 @@
 import google.generativeai as genai
 
 
+# Discord output - summaries longer than max_messages messages are sent as a file
+
+DISCORD_OUTPUT = {
+    "message_limit": 2000,
+    "max_messages": 2,
+    "chars_per_token": 3,
+    "send_retries": 3,
+    "retry_delay": 1,
+}
+
+# Tokens which can still be delivered as messages, used as the model output limit
+OUTPUT_TOKEN_BUDGET = (
+    DISCORD_OUTPUT["message_limit"]
+    * DISCORD_OUTPUT["max_messages"]
+    // DISCORD_OUTPUT["chars_per_token"]
+)
+
+
 # Gooogle LLM Model
 
-MODEL_GOOGLE_GEMINI = {"flash_lite": "gemini-2.0-flash-lite"}
+MODEL_GOOGLE_GEMINI = {
+    "flash_lite": "gemini-2.0-flash-lite",
+    "flash_cached": "models/gemini-2.0-flash-001",
+}
 
 
 # Google LLM config
 
 GEMINI_LLM_CONFIG = genai.GenerationConfig(
-    max_output_tokens=2048, temperature=1.0, top_p=0.9
+    max_output_tokens=min(2048, OUTPUT_TOKEN_BUDGET), temperature=1.0, top_p=0.9
 )
 
 
+# Gemini context caching - transcripts longer than min_chars are cached on the server,
+# ttl and clear_timeout (deleting caches when the bot stops) in seconds
+
+GEMINI_CONTEXT_CACHE = {
+    "enabled": True,
+    "ttl": 3600,
+    "max_entries": 20,
+    "max_seen": 500,
+    "min_chars": 16000,
+    "clear_timeout": 5,
+}
+
+
 # Local models
 
 MODEL_DISCORD_SUMMARY_LOCAL = {
@@ -28,6 +62,42 @@ MODEL_YT_SUMMARY_PL_LOCAL = {
 MODEL_YT_SUMMARY_PL_LOCAL = {"normal": "deepseek-r1:8b", "ez": "deepseek-r1:1.5b"}
 
 
+# Ollama hosts used in local mode - timeouts and intervals in seconds
+
+OLLAMA_POOL = {
+    "hosts": ["http://localhost:11434"],
+    "timeout": 300,
+    "health_check_interval": 30,
+    "health_check_timeout": 3,
+}
+
+
+# Local model selection - the "normal" tier is used when its predicted latency
+# (in seconds) fits the SLO, otherwise the "ez" tier is used. Until enough
+# measurements are collected, the latency is estimated from the default fixed
+# cost, input (prompt processing) speed and output (generation) speed. Samples
+# older than sample_max_age seconds are dropped. While the "normal" tier is
+# predicted over the SLO, it gets at most one probe request per probe_interval.
+# num_ctx covers the system instruction, input, output and template_tokens,
+# multiplied by context_margin, because Polish text often has fewer
+# characters per token than chars_per_token.
+
+MODEL_SELECTION = {
+    "latency_slo": 90,
+    "history": 20,
+    "sample_max_age": 1800,
+    "probe_interval": 900,
+    "parallel_requests": 1,
+    "chars_per_token": 3,
+    "template_tokens": 100,
+    "context_margin": 1.2,
+    "fixed_seconds": {"normal": 3, "ez": 1},
+    "seconds_per_1k_input_tokens": {"normal": 4, "ez": 1.5},
+    "output_tokens_per_second": {"normal": 15, "ez": 30},
+    "num_ctx": {"min": 2048, "max": 16384},
+}
+
+
 # Gemini API system instructions
 
 GEMINI_SYS_INSTRUCTION_YT_EN = (
@@ -53,6 +123,10 @@ GEMINI_SYS_INSTRUCTION_YT_PL = (
     "W moich podsumowaniach nie pomijam żadnych informacji z transkryptu."
 )
 
+GEMINI_CACHED_PROMPT_YT_EN = "Summarize the transcript."
+
+GEMINI_CACHED_PROMPT_YT_PL = "Podsumuj transkrypt."
+
 GEMINI_SYS_INSTRUCTION_DISCUSSION_SUMMARY = (
     "Twoim zadaniem jest podsumować dostarczoną rozmowę. "
     "Podsumowanie nie może przekroczyć 2000 znaków długości. "
@@ -96,9 +170,21 @@ SETTINGS_YT_SUMMARY = {
     "num_ctx": 4096,
     "top_k": 10,
     "temperature": 0.2,
-    "num_predict": 750,
+    "num_predict": min(750, OUTPUT_TOKEN_BUDGET),
+}
+
+SETTINGS_DISCUSSION_SUMMARY = {
+    "num_ctx": 8192,
+    "top_k": 10,
+    "temperature": 0.2,
+    "num_predict": min(500, OUTPUT_TOKEN_BUDGET),
 }
 
+# Reasoning models (DeepSeek-R1) - mode "off", "capped" or "full",
+# max_tokens is the reasoning limit in the "capped" mode, added to num_predict
+
+REASONING_LOCAL = {"mode": "capped", "max_tokens": 300}
+
 DEEPSEEK_SYS_INSTRUCTION_YT = (
     "I'm a part of the app which summarizes YouTube videos. "
     "My task is to summarize given transcripts. "
@@ -115,3 +201,35 @@ COOLDOWN_RULES = {"requests": 3, "timestamp": 60}
 # TLDR messages rules
 
 TLDR_MESSAGES = {"default": 50, "min": 30, "max": 300}
+
+# Topic-scoped TLDR - embedding index of the channel history
+
+DISCUSSION_INDEX = {
+    "directory": "data/index",
+    "embedding_model": "bge-m3",
+    "history_limit": 5000,
+    "batch_size": 64,
+    "top_k": 80,
+    "min_score": 0.35,
+    "max_chars": 10000,
+    "max_topic_length": 100,
+}
+
+# Event loop watchdog - intervals and thresholds in seconds
+
+LOOP_WATCHDOG = {
+    "interval": 0.5,
+    "threshold": 0.25,
+    "report_interval": 300,
+    "buckets": (0.01, 0.05, 0.1, 0.25, 0.5, 1, 5),
+}
+
+# Graceful shutdown - jobs of these commands are written to the journal and replayed
+# after the restart, timeouts and ages in seconds
+
+JOB_JOURNAL = {
+    "path": "data/job_journal.jsonl",
+    "commands": ("tldr", "tldw"),
+    "drain_timeout": 60,
+    "max_age": 3600,
+}
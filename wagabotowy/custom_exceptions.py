@@ -12,3 +12,11 @@ class TooManyWordsError(Exception):
 
 class TryinToOmitWordsLimitError(Exception):
     "Raised when someone wants to bypass word limiter in coto function."
+
+
+class OllamaNotWorkingError(Exception):
+    "Raised when none of the configured Ollama hosts is working."
+
+
+class GenerationCancelledError(Exception):
+    "Raised when the local generation is stopped by the bot shutdown."
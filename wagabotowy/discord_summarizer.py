@@ -5,6 +5,8 @@ import asyncio
 import concurrent.futures
 from functools import partial
 from datetime import datetime
+import signal
+import time
 import sys
 import os
 
@@ -13,11 +15,18 @@ import custom_exceptions as e
 import local_yt_summary as yts
 import gemini_api_connection as gapi
 import local_discussion_summary as cds
+import loop_watchdog
+import ollama_pool
+import message_sender as ms
+import discussion_index as di
+import model_selector
+import job_journal
 
 import keyring
 
 import discord
 from discord.ext import commands
+from ollama import ResponseError
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -27,6 +36,8 @@ bot = commands.Bot(
 )
 start_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 executor = concurrent.futures.ThreadPoolExecutor()
+# Single thread keeps journal writes (fsync) off the event loop and in order
+journal_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
 
 def create_parser():
@@ -40,7 +51,36 @@ def create_parser():
     parser.add_argument(
         "--ez_mode",
         action="store_true",
-        help="Enable easy mode which runs smaller models to reduce needed computing resources",
+        help="Enable easy mode which always runs smaller models instead of choosing them"
+        " per request to reduce needed computing resources",
+    )
+    parser.add_argument(
+        "--latency_slo",
+        type=float,
+        default=app_parameters.MODEL_SELECTION["latency_slo"],
+        help="Latency in seconds above which smaller local models are chosen",
+    )
+    parser.add_argument(
+        "--reasoning",
+        choices=["off", "capped", "full"],
+        default=app_parameters.REASONING_LOCAL["mode"],
+        help="Reasoning mode of local reasoning models, capped limits the thinking tokens",
+    )
+    parser.add_argument(
+        "--ollama_host",
+        action="append",
+        help="Ollama host used in local mode, can be passed many times to spread the load",
+    )
+    parser.add_argument(
+        "--loop_watchdog",
+        action="store_true",
+        help="Measures event loop lag and logs stacks of code blocking the loop",
+    )
+    parser.add_argument(
+        "--loop_lag_threshold",
+        type=float,
+        default=app_parameters.LOOP_WATCHDOG["threshold"],
+        help="Event loop lag in seconds above which the blocking stack is logged",
     )
     return parser
 
@@ -74,27 +114,156 @@ def get_discord_bot_token():
         return None
 
 
-parser = create_parser()
-args = parser.parse_args()
+def configure_logging():
+    """Logs to the console and to the new file in the logs directory."""
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    file_handler = logging.FileHandler(
+        f"logs/{start_time}.log", mode="w", encoding="utf-8"
+    )
+    file_handler.setLevel(logging.DEBUG)
 
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.INFO)
-file_handler = logging.FileHandler(f"logs/{start_time}.log", mode="w", encoding="utf-8")
-file_handler.setLevel(logging.DEBUG)
+    logging.basicConfig(
+        level=logging.DEBUG,  # Set the log level to DEBUG
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",  # Define the format
+        datefmt="%Y-%m-%d %H:%M:%S",  # Define the date format
+        handlers=[file_handler, console_handler],
+    )
 
 
-logging.basicConfig(
-    level=logging.DEBUG,  # Set the log level to DEBUG
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",  # Define the format
-    datefmt="%Y-%m-%d %H:%M:%S",  # Define the date format
-    handlers=[file_handler, console_handler],
-)
+# Set in the __main__ block only, so importing this module doesn't parse
+# arguments, open logs or touch the journal
+args = None
+selector = None
+journal = None
+running_jobs = set()
+shutting_down = False
+journal_replayed = False
+# References to background tasks, the event loop keeps only weak ones
+shutdown_task = None
+replay_tasks = set()
 
 
 @bot.event
 async def on_ready():
-    """Informs that the bot is logged in."""
+    """Informs that the bot is logged in and replays jobs interrupted by the restart."""
+    global journal_replayed
     logging.info("Logged in as %s", bot.user)
+    if not journal_replayed:
+        journal_replayed = True
+        await replay_unfinished_jobs()
+
+
+@bot.check
+async def accept_commands(ctx):
+    """Rejects new commands when the bot is shutting down."""
+    if shutting_down:
+        await ctx.send("Właśnie się restartuję, spróbuj za chwilę.")
+        return False
+    return True
+
+
+@bot.before_invoke
+async def register_job(ctx):
+    """Tracks the running command and writes long jobs to the journal."""
+    running_jobs.add(asyncio.current_task())
+    if ctx.command.name in app_parameters.JOB_JOURNAL["commands"]:
+        await write_journal(
+            journal.start, ctx.command.name, ctx.channel.id, ctx.message.id
+        )
+
+
+@bot.after_invoke
+async def unregister_job(ctx):
+    """Marks the job as finished unless it was interrupted by the shutdown."""
+    task = asyncio.current_task()
+    running_jobs.discard(task)
+    if shutting_down and task.cancelling():
+        logging.info("Job %s interrupted, left in the journal", ctx.message.id)
+        return
+    await write_journal(journal.finish, ctx.message.id)
+
+
+async def write_journal(function, *args):
+    """Runs the journal method in the journal thread.
+
+    Args:
+        function (callable): JobJournal method.
+
+    Returns:
+        Any: Result of the method.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(journal_executor, partial(function, *args))
+
+
+async def replay_unfinished_jobs():
+    """Runs again the jobs which were interrupted by the last shutdown."""
+    for record in journal.unfinished_jobs():
+        if time.time() - record["started_at"] > app_parameters.JOB_JOURNAL["max_age"]:
+            logging.info("Job %s is too old to replay", record["message_id"])
+            await write_journal(journal.finish, record["message_id"])
+            continue
+        try:
+            channel = bot.get_channel(record["channel_id"]) or await bot.fetch_channel(
+                record["channel_id"]
+            )
+            message = await channel.fetch_message(record["message_id"])
+        except discord.errors.DiscordException as exc:
+            logging.warning("Can't replay job %s: %s", record["message_id"], exc)
+            await write_journal(journal.finish, record["message_id"])
+            continue
+        ctx = await bot.get_context(message)
+        if ctx.command is None:
+            await write_journal(journal.finish, record["message_id"])
+            continue
+        logging.info("Replaying %s job %s", record["command"], record["message_id"])
+        task = asyncio.create_task(replay_job(ctx))
+        replay_tasks.add(task)
+        task.add_done_callback(replay_tasks.discard)
+
+
+async def replay_job(ctx):
+    """Invokes the command again, skipping checks and cooldowns."""
+    try:
+        await ctx.reinvoke(call_hooks=True)
+    except Exception:
+        logging.exception("Replayed job %s failed", ctx.message.id)
+        await write_journal(journal.finish, ctx.message.id)
+
+
+def request_shutdown():
+    """Starts the shutdown on SIGTERM, keeping the reference to its task."""
+    global shutdown_task
+    if shutdown_task is None:
+        shutdown_task = asyncio.create_task(shutdown())
+
+
+async def shutdown():
+    """Stops accepting commands, drains running jobs and closes the bot.
+    Jobs not finished before the deadline stay in the journal and are replayed
+    after the restart. Their local generations are stopped, the rest of the
+    executor threads is left behind by exiting the process in the __main__ block.
+    """
+    global shutting_down
+    if shutting_down:
+        return
+    shutting_down = True
+    timeout = app_parameters.JOB_JOURNAL["drain_timeout"]
+    logging.info(
+        "Shutting down, waiting up to %s s for %s jobs", timeout, len(running_jobs)
+    )
+    if running_jobs:
+        _, pending = await asyncio.wait(set(running_jobs), timeout=timeout)
+        if pending:
+            ollama_pool.cancel_generation()
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning("%s jobs left unfinished in the journal", len(pending))
+            await asyncio.wait(pending)
+    await write_journal(journal.compact)
+    await bot.close()
 
 
 @bot.command()
@@ -106,20 +275,27 @@ async def hello(ctx):
 
 @bot.command(
     help="Tworzy podsumowanie dyskusji do X wiadomości wstecz (domyślnie 50, min 5, max 200)"
+    " albo podsumowanie wiadomości na podany temat"
 )
 @commands.cooldown(
     app_parameters.COOLDOWN_RULES["requests"],
     app_parameters.COOLDOWN_RULES["timestamp"],
     commands.BucketType.user,
 )
-async def tldr(ctx, messages_limit=app_parameters.TLDR_MESSAGES["default"]):
+async def tldr(ctx, *, messages_limit=str(app_parameters.TLDR_MESSAGES["default"])):
     """Creates the discussion summary and sends it as the message.
+    When a topic is given instead of the number, summarizes messages about the topic.
 
     Args:
-        limit (int): Amount of messages taken for the summary.
+        messages_limit (str): Amount of messages taken for the summary or the topic.
     """
     tracemalloc.start()
     channel = ctx.channel
+    try:
+        int(messages_limit)
+    except ValueError:
+        await tldr_topic(ctx, messages_limit.strip())
+        return
     message_about_number_of_messages, messages_limit = format_tldr_input_number_to_int(
         messages_limit, app_parameters.TLDR_MESSAGES["max"], app_parameters.TLDR_MESSAGES["min"]
     )
@@ -130,7 +306,8 @@ async def tldr(ctx, messages_limit=app_parameters.TLDR_MESSAGES["default"]):
     await ctx.send(message_about_number_of_messages)
     logging.info("Tworzę podsumowanie ostatnich %s wiadomości", messages_limit)
     messages = []
-    async for message in channel.history(limit=messages_limit + 1):
+    # Messages before the command, so a replayed job summarizes the same window
+    async for message in channel.history(limit=messages_limit, before=ctx.message):
         messages.append(message)
 
     content_list = [
@@ -142,21 +319,29 @@ async def tldr(ctx, messages_limit=app_parameters.TLDR_MESSAGES["default"]):
     content = "\n".join(content_list)
     cleaned_content = cds.clean_discussion_string(content)
     logging.info(cleaned_content)
+    await send_discussion_summary(ctx, cleaned_content)
+
+
+async def send_discussion_summary(ctx, cleaned_content):
+    """Generates the discussion summary and sends it.
 
+    Args:
+        cleaned_content (str): Cleaned Discord discussion.
+    """
     if args.local:  # Used when we run models locally
         try:
-            if args.ez_mode:
-                model = app_parameters.MODEL_DISCORD_SUMMARY_LOCAL["ez"]
-            else:
-                model = app_parameters.MODEL_DISCORD_SUMMARY_LOCAL["normal"]
             loop = asyncio.get_running_loop()
-            summary_generator = partial(cds.generate_summary, model, cleaned_content)
             logging.info("Starting generating the summary")
-            message = await loop.run_in_executor(executor, summary_generator)
+            with selector.run("discussion", cleaned_content) as choice:
+                summary_generator = partial(
+                    cds.generate_summary, choice.model, cleaned_content, choice.num_ctx
+                )
+                message = await loop.run_in_executor(executor, summary_generator)
             logging.info("Successfully generated the summary")
         except Exception:
             logging.info("Failed to generate the summary")
             await ctx.send("Coś się popsuło i nie było mnie słychać!")
+            return
 
     else:  # Used when we use Gemini API
         try:
@@ -166,16 +351,14 @@ async def tldr(ctx, messages_limit=app_parameters.TLDR_MESSAGES["default"]):
                 executor, gapi.create_discussion_summary, cleaned_content
             )
             logging.info("Successfully generated the summary")
-        except:
+        except Exception:
             logging.info("Failed to generate the summary")
             await ctx.send("Coś się popsuło i nie było mnie słychać!")
+            return
 
     logging.info("Message to send: %s", message)
     try:
-        await ctx.send(message)
-    except discord.errors.ConnectionClosed:
-        await on_disconnect()
-        await ctx.send(message)
+        await ms.send_long_message(ctx, message)
     except Exception:
         logging.info(
             "Coś się zepsuło i nie było mnie słychać. Message length: %s", len(message)
@@ -183,14 +366,99 @@ async def tldr(ctx, messages_limit=app_parameters.TLDR_MESSAGES["default"]):
         await ctx.send("Coś się popsuło i nie było mnie słychać.")
 
 
+async def tldr_topic(ctx, topic):
+    """Summarizes the channel messages related to the topic.
+    Updates the channel embedding index with messages posted since the last use.
+
+    Args:
+        topic (str): Topic of the summary.
+    """
+    if len(topic) > app_parameters.DISCUSSION_INDEX["max_topic_length"]:
+        await ctx.send("Temat jest za długi, opisz go krócej.")
+        return
+    await ctx.send(f"Już się robi! Szukam wiadomości na temat: {topic}")
+    loop = asyncio.get_running_loop()
+    try:
+        # Loading the index parses its metadata file, so it's kept off the event loop
+        index = await loop.run_in_executor(executor, di.get_index, ctx.channel.id)
+        entries = await fetch_index_entries(ctx, index.last_message_id)
+        added = await loop.run_in_executor(executor, index.add_messages, entries)
+        logging.info("Indexed %s new messages of channel %s", added, ctx.channel.id)
+        found = await loop.run_in_executor(
+            executor,
+            partial(
+                index.search,
+                topic,
+                app_parameters.DISCUSSION_INDEX["top_k"],
+                app_parameters.DISCUSSION_INDEX["min_score"],
+            ),
+        )
+    except e.OllamaNotWorkingError:
+        logging.warning("Ollama is not working, can't search messages")
+        await ctx.send("Wyszukiwanie po temacie wymaga działającej Ollamy.")
+        return
+    except ResponseError as exc:
+        logging.warning("Ollama can't embed messages: %s", exc)
+        await ctx.send(
+            "Model do wyszukiwania nie jest dostępny, "
+            f"pobierz go: ollama pull {app_parameters.DISCUSSION_INDEX['embedding_model']}"
+        )
+        return
+    except discord.Forbidden:
+        logging.warning("Missing access to the history of channel %s", ctx.channel.id)
+        await ctx.send("Nie mam dostępu do historii tego kanału.")
+        return
+    except Exception:
+        logging.exception("Failed to search messages about %s", topic)
+        await ctx.send("Coś się popsuło i nie było mnie słychać!")
+        return
+    if not found:
+        await ctx.send("Nie znalazłem wiadomości na ten temat.")
+        return
+    logging.info("Found %s messages about %s", len(found), topic)
+    content = di.format_messages(found, app_parameters.DISCUSSION_INDEX["max_chars"])
+    await send_discussion_summary(ctx, f"Temat: {topic}\n{content}")
+
+
+async def fetch_index_entries(ctx, last_message_id):
+    """Fetches channel messages posted after the last indexed one.
+
+    Args:
+        last_message_id (int | None): ID of the last indexed message, None for an empty index.
+
+    Returns:
+        list[dict]: Index entries from the oldest.
+    """
+    if last_message_id is None:
+        history = ctx.channel.history(
+            limit=app_parameters.DISCUSSION_INDEX["history_limit"]
+        )
+    else:
+        history = ctx.channel.history(
+            limit=app_parameters.DISCUSSION_INDEX["history_limit"],
+            after=discord.Object(last_message_id),
+        )
+    entries = []
+    async for message in history:
+        entry = di.to_index_entry(message, bot.user)
+        if entry is not None:
+            entries.append(entry)
+    entries.sort(key=lambda entry: entry["id"])
+    return entries
+
+
 @tldr.error
 async def tldr_error(ctx, error):
-    """Runs when someone uses the tldr command during the cooldown"""
+    """Runs when someone uses the tldr command during the cooldown
+    or when the command failed"""
     if isinstance(error, commands.CommandOnCooldown):
         retry_after = round(error.retry_after, 2)
         await ctx.send(
             f"{ctx.author.mention} masz cooldowna. Spróbuj za {retry_after:.2f} sekund."
         )
+    elif isinstance(error, commands.CommandInvokeError):
+        logging.error("tldr failed", exc_info=error.original)
+        await ctx.send("Coś się popsuło i nie było mnie słychać!")
 
 
 @bot.command(
@@ -219,7 +487,9 @@ async def tldw(ctx):
 
         if args.local:  # Used when we run models locally
             loop = asyncio.get_running_loop()
-            summary_generator = partial(yts.generate_summary, link, args.ez_mode)
+            summary_generator = partial(
+                yts.generate_summary, link, selector, args.reasoning
+            )
             message = await loop.run_in_executor(executor, summary_generator)
 
         else:
@@ -230,11 +500,7 @@ async def tldw(ctx):
 
         logging.info("Successfully generated the summary")
         logging.info(message)
-        try:
-            await ctx.send(message)
-        except discord.errors.ConnectionClosed:
-            await on_disconnect()
-            await ctx.send(message)
+        await ms.send_long_message(ctx, message)
     except ValueError:
         await ctx.send("Nie wygląda to jak link do filmu na YT!")
     except e.MissingTranscriptError:
@@ -291,11 +557,7 @@ async def coto(ctx, *, thing: str):
 
         logging.info("Successfully generated coto")
         logging.info(message)
-        try:
-            await ctx.send(message)
-        except discord.errors.ConnectionClosed:
-            await on_disconnect()
-            await ctx.send(message)
+        await ms.send_long_message(ctx, message)
     except e.TooManyWordsError:
         await ctx.send("Za dużo słów. Maksymalna liczba to trzy.")
     except e.TryinToOmitWordsLimitError:
@@ -316,6 +578,43 @@ async def coto_error(ctx, error):
         )
 
 
+@bot.event
+async def on_raw_message_delete(payload):
+    """Removes the deleted message from the channel index."""
+    await remove_indexed_messages(payload.channel_id, [payload.message_id])
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    """Removes the deleted messages from the channel index."""
+    await remove_indexed_messages(payload.channel_id, list(payload.message_ids))
+
+
+@bot.event
+async def on_raw_message_edit(payload):
+    """Removes the edited message from the channel index, its old content is stale."""
+    cached = payload.cached_message
+    if cached is not None and cached.content == payload.message.content:
+        return  # Embed updates, e.g. link previews
+    await remove_indexed_messages(payload.channel_id, [payload.message_id])
+
+
+async def remove_indexed_messages(channel_id, message_ids):
+    """Removes messages from the channel index in the executor.
+
+    Args:
+        channel_id (int): Discord channel ID.
+        message_ids (list[int]): IDs of the messages.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(
+            executor, di.remove_messages, channel_id, message_ids
+        )
+    except OSError as exc:
+        logging.warning("Can't remove messages from the index: %s", exc)
+
+
 @bot.event
 async def on_disconnect():
     """Used when the bot disconnected from the server"""
@@ -346,22 +645,67 @@ def format_tldr_input_number_to_int(messages_number, upper_limit, lower_limit):
     return message, messages_number
 
 
+async def clear_context_cache():
+    """Deletes Gemini cached contents, giving up after the timeout.
+    Contents not deleted in time expire on the server after their TTL.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.wait_for(
+            loop.run_in_executor(journal_executor, gapi.clear_context_cache),
+            timeout=app_parameters.GEMINI_CONTEXT_CACHE["clear_timeout"],
+        )
+    except asyncio.TimeoutError:
+        logging.warning("Gemini cached contents not deleted, they expire after TTL")
+
+
 async def main():
     """Runs the bot"""
     if args.local:
         logging.info("Running models locally")
+        ollama_pool.configure_pool(
+            args.ollama_host or app_parameters.OLLAMA_POOL["hosts"]
+        )
         if args.ez_mode:
             logging.info("Easy mode enabled!")
         else:
-            logging.info("Easy mode disabled!")
+            logging.info("Easy mode disabled! Latency SLO: %s s", args.latency_slo)
     else:
         gapi.configure_genai()
         logging.info("Runing models using Gemini")
-    async with bot:
-        TOKEN = get_discord_bot_token()
-        await bot.start(TOKEN)
+    watchdog = None
+    if args.loop_watchdog:
+        watchdog = loop_watchdog.LoopWatchdog(threshold=args.loop_lag_threshold)
+        watchdog.start(asyncio.get_running_loop())
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, request_shutdown)
+    except NotImplementedError:  # Signal handlers are not available on Windows
+        logging.info("SIGTERM handling not available")
+    try:
+        async with bot:
+            TOKEN = get_discord_bot_token()
+            await bot.start(TOKEN)
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+        if not args.local:
+            await clear_context_cache()
+        executor.shutdown(wait=False, cancel_futures=True)
+        journal_executor.shutdown(wait=False)
 
 
 if __name__ == "__main__":
+    args = create_parser().parse_args()
+    configure_logging()
+    selector = model_selector.ModelSelector(
+        latency_slo=args.latency_slo, pinned_tier="ez" if args.ez_mode else None
+    )
+    journal = job_journal.JobJournal(app_parameters.JOB_JOURNAL["path"])
     with asyncio.Runner() as runner:
         runner.run(main())
+    if shutting_down:
+        # The journal is compacted, executor threads still waiting for Gemini
+        # or Ollama responses would be joined at exit, so they are skipped
+        logging.info("Bot stopped")
+        logging.shutdown()
+        os._exit(0)
@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+import app_parameters
+import ollama_pool
+import local_discussion_summary as cds
+
+
+class ChannelIndex:
+    """Incremental embedding index of one Discord channel.
+
+    Normalized float32 vectors are appended to a file read through a memory map,
+    message metadata is appended to a JSON Lines file - one line per vector row.
+    The state file (model and dimension) is written after the first rows, so an
+    index without it is incomplete. Files which can't be loaded are removed and
+    the index is rebuilt from the channel history. Deleted and edited messages
+    are appended to the deleted IDs file and skipped by the search, edited
+    messages are not indexed again.
+    """
+
+    def __init__(self, channel_id, directory, model):
+        self.channel_id = channel_id
+        self.model = model
+        self.vectors_path = os.path.join(directory, f"{channel_id}.vectors")
+        self.messages_path = os.path.join(directory, f"{channel_id}.jsonl")
+        self.state_path = os.path.join(directory, f"{channel_id}.json")
+        self.deleted_path = os.path.join(directory, f"{channel_id}.deleted")
+        self.lock = threading.Lock()
+        self.messages = []
+        self.deleted = set()
+        self.dimension = None
+        self.vectors = None
+        self.load()
+
+    @property
+    def last_message_id(self):
+        """int | None: ID of the newest indexed message."""
+        return self.messages[-1]["id"] if self.messages else None
+
+    def load(self):
+        """Loads the index from disk, dropping it if it was built with another model,
+        was not written completely or can't be read.
+        """
+        if not os.path.exists(self.state_path):
+            # Files left by the first write interrupted before the state file
+            self.remove_files()
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as state_file:
+                state = json.load(state_file)
+            if state["model"] != self.model:
+                logging.info(
+                    "Embedding model changed, rebuilding index of channel %s",
+                    self.channel_id,
+                )
+                self.reset()
+                return
+            self.dimension = state["dimension"]
+            with open(self.messages_path, "r", encoding="utf-8") as messages_file:
+                self.messages = [json.loads(line) for line in messages_file]
+            size = os.path.getsize(self.vectors_path)
+            if size != 4 * self.dimension * len(self.messages):
+                raise ValueError(
+                    f"{size} bytes of vectors for {len(self.messages)} messages"
+                )
+            if os.path.exists(self.deleted_path):
+                with open(self.deleted_path, "r", encoding="utf-8") as deleted_file:
+                    self.deleted = {int(line) for line in deleted_file if line.strip()}
+            self.open_vectors()
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            logging.warning(
+                "Index of channel %s is broken (%s), rebuilding it",
+                self.channel_id,
+                exc,
+            )
+            self.reset()
+
+    def reset(self):
+        """Empties the index and removes its files."""
+        self.messages = []
+        self.deleted = set()
+        self.dimension = None
+        self.vectors = None
+        self.remove_files()
+
+    def remove_files(self):
+        """Removes index files of the channel."""
+        for path in (
+            self.vectors_path,
+            self.messages_path,
+            self.state_path,
+            self.deleted_path,
+        ):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def open_vectors(self):
+        """Maps the vectors file into memory (read only)."""
+        rows = len(self.messages)
+        if rows == 0:
+            self.vectors = None
+            return
+        self.vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimension)
+        )
+
+    def add_messages(self, messages):
+        """Embeds and appends messages newer than the last indexed one.
+
+        Args:
+            messages (list[dict]): Messages with "id", "author" and "content" keys,
+                from the oldest.
+
+        Returns:
+            int: Number of added messages.
+        """
+        with self.lock:
+            last_id = self.last_message_id or 0
+            messages = [message for message in messages if message["id"] > last_id]
+            batch_size = app_parameters.DISCUSSION_INDEX["batch_size"]
+            for start in range(0, len(messages), batch_size):
+                batch = messages[start : start + batch_size]
+                vectors = embed([message["content"] for message in batch])
+                self.append(batch, vectors)
+            return len(messages)
+
+    def append(self, messages, vectors):
+        """Writes the vectors and metadata to disk and remaps the vectors file.
+
+        Args:
+            messages (list[dict]): Message metadata.
+            vectors (np.ndarray): Normalized vectors, one row per message.
+        """
+        with open(self.vectors_path, "ab") as vectors_file:
+            vectors_file.write(vectors.astype(np.float32).tobytes())
+        with open(self.messages_path, "a", encoding="utf-8") as messages_file:
+            for message in messages:
+                messages_file.write(json.dumps(message, ensure_ascii=False) + "\n")
+        if self.dimension is None:
+            # Written last, so the index is complete only when the state file exists
+            self.dimension = vectors.shape[1]
+            with open(self.state_path, "w", encoding="utf-8") as state_file:
+                json.dump({"model": self.model, "dimension": self.dimension}, state_file)
+        self.messages.extend(messages)
+        self.open_vectors()
+
+    def remove_messages(self, message_ids):
+        """Excludes deleted or edited messages from the search.
+
+        Args:
+            message_ids (list[int]): IDs of the messages.
+        """
+        with self.lock:
+            if self.dimension is None:
+                return
+            with open(self.deleted_path, "a", encoding="utf-8") as deleted_file:
+                for message_id in message_ids:
+                    deleted_file.write(f"{message_id}\n")
+            self.deleted.update(message_ids)
+
+    def search(self, topic, top_k, min_score):
+        """Finds messages related to the topic.
+
+        Args:
+            topic (str): Searched topic.
+            top_k (int): Maximum number of returned messages.
+            min_score (float): Minimum cosine similarity.
+
+        Returns:
+            list[dict]: Related messages in chronological order.
+        """
+        with self.lock:
+            if self.vectors is None:
+                return []
+            scores = self.vectors @ embed([topic])[0]
+            top_k = min(top_k, len(scores))
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = sorted(index for index in best if scores[index] >= min_score)
+            return [
+                self.messages[index]
+                for index in best
+                if self.messages[index]["id"] not in self.deleted
+            ]
+
+
+def embed(texts):
+    """Creates normalized embeddings of the texts.
+
+    Args:
+        texts (list[str]): Texts to embed.
+
+    Returns:
+        np.ndarray: Normalized vectors, one row per text.
+    """
+    response = ollama_pool.embed(
+        app_parameters.DISCUSSION_INDEX["embedding_model"], input=texts
+    )
+    vectors = np.asarray(response["embeddings"], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+indexes = {}
+indexes_lock = threading.Lock()
+
+
+def get_index(channel_id):
+    """Returns the index of the channel, loading it from disk on first use.
+
+    Args:
+        channel_id (int): Discord channel ID.
+
+    Returns:
+        ChannelIndex: Index of the channel.
+    """
+    with indexes_lock:
+        if channel_id not in indexes:
+            directory = app_parameters.DISCUSSION_INDEX["directory"]
+            os.makedirs(directory, exist_ok=True)
+            indexes[channel_id] = ChannelIndex(
+                channel_id,
+                directory,
+                app_parameters.DISCUSSION_INDEX["embedding_model"],
+            )
+        return indexes[channel_id]
+
+
+def remove_messages(channel_id, message_ids):
+    """Excludes deleted or edited messages from the channel index, if it exists.
+
+    Args:
+        channel_id (int): Discord channel ID.
+        message_ids (list[int]): IDs of the messages.
+    """
+    state_path = os.path.join(
+        app_parameters.DISCUSSION_INDEX["directory"], f"{channel_id}.json"
+    )
+    if channel_id in indexes or os.path.exists(state_path):
+        get_index(channel_id).remove_messages(message_ids)
+
+
+def to_index_entry(message, bot_user):
+    """Converts the Discord message into the index entry.
+    Bot messages and commands (messages mentioning the bot) are skipped.
+
+    Args:
+        message (discord.Message): Discord message.
+        bot_user (discord.ClientUser): User of the bot.
+
+    Returns:
+        dict | None: Index entry or None when there is nothing worth indexing.
+    """
+    if message.author == bot_user or bot_user in message.mentions:
+        return None
+    content = cds.clean_discussion_string(message.content).strip()
+    if not content or message.content.startswith("!"):
+        return None
+    return {"id": message.id, "author": str(message.author), "content": content}
+
+
+def format_messages(messages, max_chars):
+    """Joins found messages into the discussion passed to the model.
+
+    Args:
+        messages (list[dict]): Index entries in chronological order.
+        max_chars (int): Maximum discussion length, the newest messages are kept.
+
+    Returns:
+        str: Discussion in the "author: content" format.
+    """
+    lines = []
+    length = 0
+    for message in reversed(messages):
+        line = f"{message['author']}: {message['content']}"
+        length += len(line) + 1
+        if length > max_chars:
+            break
+        lines.append(line)
+    return "\n".join(reversed(lines))
@@ -7,6 +7,10 @@ import google.generativeai as genai
 import local_yt_summary as yts
 import custom_exceptions as e
 import app_parameters
+import gemini_cache
+
+
+context_cache = None
 
 
 def configure_genai():
@@ -32,12 +36,31 @@ def configure_genai():
             logging.info("GOOGLE_AI_API_KEY fetched from keyring.")
 
         genai.configure(api_key=GOOGLE_AI_API_KEY)
+        configure_context_cache(gemini_cache.GeminiCacheBackend())
 
     except Exception as e:
         logging.error("Error fetching GOOGLE_AI_API_KEY: %s", e)
         return None
 
 
+def configure_context_cache(backend):
+    """Creates the context cache used for long transcripts.
+
+    Args:
+        backend (gemini_cache.GeminiCacheBackend): Backend creating cached contents,
+            gemini_cache.FakeGeminiCacheBackend can be used offline.
+    """
+    global context_cache
+    if app_parameters.GEMINI_CONTEXT_CACHE["enabled"]:
+        context_cache = gemini_cache.GeminiContextCache(backend)
+
+
+def clear_context_cache():
+    """Deletes all cached contents from the server."""
+    if context_cache is not None:
+        context_cache.clear()
+
+
 def create_youtube_summary(message_with_yt_link):
     """Creates a summary of YT video from a message with link.
 
@@ -53,17 +76,35 @@ def create_youtube_summary(message_with_yt_link):
     transcript, language = yts.create_transcript(message_with_yt_link)
     if language.startswith("Polish"):
         system_instruction = app_parameters.GEMINI_SYS_INSTRUCTION_YT_PL
+        cached_prompt = app_parameters.GEMINI_CACHED_PROMPT_YT_PL
     else:
         system_instruction = app_parameters.GEMINI_SYS_INSTRUCTION_YT_EN
+        cached_prompt = app_parameters.GEMINI_CACHED_PROMPT_YT_EN
+    transcript = transcript[:20000]
+    if (
+        context_cache is not None
+        and len(transcript) >= app_parameters.GEMINI_CONTEXT_CACHE["min_chars"]
+    ):
+        video_id = yts.extract_youtube_id(message_with_yt_link)
+        try:
+            response_text = context_cache.generate(
+                video_id, system_instruction, transcript, cached_prompt
+            )
+            if response_text is not None:
+                logging.info(response_text)
+                return response_text
+        except Exception as exc:
+            logging.warning("Cached generation failed, sending full prompt: %s", exc)
     model = genai.GenerativeModel(
         app_parameters.MODEL_GOOGLE_GEMINI["flash_lite"],
         generation_config=app_parameters.GEMINI_LLM_CONFIG,
         system_instruction=system_instruction,
     )
     try:
-        response = model.generate_content([transcript[:20000]])
-        logging.info(response.text)
-        return response.text
+        # Measured like the cached requests, so their input tokens and TTFT compare
+        response_text = gemini_cache.generate_measured(model, [transcript], "uncached")
+        logging.info(response_text)
+        return response_text
     except Exception as exc:
         logging.info("Gemini is not working")
         raise e.GeminiNotWorkingError("Gemini is not working")
@@ -0,0 +1,332 @@
+import collections
+import hashlib
+import itertools
+import logging
+import threading
+import time
+
+from google.api_core import exceptions
+import google.generativeai as genai
+from google.generativeai import caching
+
+import app_parameters
+
+
+class GeminiCacheBackend:
+    """Creates and uses server-side cached contents through the Gemini API."""
+
+    def create(self, model, system_instruction, contents, ttl):
+        """Creates the cached content.
+
+        Returns:
+            caching.CachedContent: Handle of the cached content.
+        """
+        return caching.CachedContent.create(
+            model=model,
+            system_instruction=system_instruction,
+            contents=contents,
+            ttl=ttl,
+        )
+
+    def refresh(self, handle, ttl):
+        """Extends the cached content lifetime."""
+        handle.update(ttl=ttl)
+
+    def delete(self, handle):
+        """Deletes the cached content."""
+        handle.delete()
+
+    def generate(self, handle, prompt, generation_config):
+        """Generates the response using the cached content.
+
+        Returns:
+            str: Response text.
+        """
+        model = genai.GenerativeModel.from_cached_content(
+            handle, generation_config=generation_config
+        )
+        return generate_measured(model, [prompt], "cached")
+
+
+class FakeGeminiCacheBackend:
+    """Offline stand-in for GeminiCacheBackend, keeps cached contents in memory.
+    Records created, refreshed, deleted and used caches, so the cache lifecycle
+    can be checked without the Gemini API. Like the API, it raises NotFound for
+    missing or expired contents and InvalidArgument below the minimum size.
+    """
+
+    def __init__(self, clock=time.monotonic, min_chars=0):
+        self.clock = clock
+        self.min_chars = min_chars
+        self.contents = {}
+        self.created = []
+        self.refreshed = []
+        self.deleted = []
+        self.generated = []
+        self.counter = itertools.count(1)
+
+    def create(self, model, system_instruction, contents, ttl):
+        """Stores the cached content in memory."""
+        if sum(len(item) for item in contents) < self.min_chars:
+            raise exceptions.InvalidArgument("Cached content is too small")
+        name = f"cachedContents/fake-{next(self.counter)}"
+        self.contents[name] = {
+            "model": model,
+            "system_instruction": system_instruction,
+            "contents": contents,
+            "expires_at": self.clock() + ttl,
+        }
+        self.created.append(name)
+        return name
+
+    def refresh(self, handle, ttl):
+        """Extends the cached content lifetime."""
+        self.get(handle)["expires_at"] = self.clock() + ttl
+        self.refreshed.append(handle)
+
+    def delete(self, handle):
+        """Deletes the cached content."""
+        self.contents.pop(handle, None)
+        self.deleted.append(handle)
+
+    def generate(self, handle, prompt, generation_config):
+        """Returns a fake response built from the cached content."""
+        cached = self.get(handle)
+        self.generated.append((handle, prompt))
+        return f"{prompt} ({sum(len(item) for item in cached['contents'])} chars)"
+
+    def get(self, handle):
+        """Returns the cached content, raising NotFound when it expired."""
+        cached = self.contents.get(handle)
+        if cached is None or cached["expires_at"] <= self.clock():
+            self.contents.pop(handle, None)
+            raise exceptions.NotFound(f"{handle} not found")
+        return cached
+
+
+def generate_measured(model, contents, label):
+    """Generates the response and logs input tokens and the time to first token.
+
+    Args:
+        model (genai.GenerativeModel): Used model.
+        contents (list[str]): Request contents.
+        label (str): Request kind shown in the log, e.g. "cached".
+
+    Returns:
+        str: Response text.
+    """
+    start = time.monotonic()
+    first_chunk = None
+    response = model.generate_content(contents, stream=True)
+    for _ in response:
+        if first_chunk is None:
+            first_chunk = time.monotonic() - start
+    usage = response.usage_metadata
+    logging.info(
+        "Gemini %s request: prompt_tokens=%s cached_tokens=%s ttft=%.2fs total=%.2fs",
+        label,
+        usage.prompt_token_count,
+        usage.cached_content_token_count,
+        first_chunk or 0.0,
+        time.monotonic() - start,
+    )
+    return response.text
+
+
+class GeminiContextCache:
+    """Reuses server-side cached transcripts and system instructions.
+
+    Cached contents are keyed by the video ID and the system instruction hash.
+    A cached content is created when the key is requested for the second time,
+    so videos summarized once don't pay for the cache storage. Keys rejected by
+    the API (e.g. transcripts below the minimum cache size) are remembered and
+    not created again. Entries are refreshed when used, dropped when their TTL
+    passes and the least recently used ones are deleted from the server above
+    max_entries. API calls are made outside the lock.
+    """
+
+    def __init__(
+        self,
+        backend,
+        model=app_parameters.MODEL_GOOGLE_GEMINI["flash_cached"],
+        ttl=app_parameters.GEMINI_CONTEXT_CACHE["ttl"],
+        max_entries=app_parameters.GEMINI_CONTEXT_CACHE["max_entries"],
+        max_seen=app_parameters.GEMINI_CONTEXT_CACHE["max_seen"],
+        clock=time.monotonic,
+    ):
+        self.backend = backend
+        self.model = model
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_seen = max_seen
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        # States of keys without a cached content: "requested", "creating" or "failed"
+        self.seen = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def create_key(video_id, system_instruction):
+        """Creates the cache key.
+
+        Args:
+            video_id (str): YouTube video ID.
+            system_instruction (str): System instruction of the model.
+
+        Returns:
+            tuple[str, str]: Video ID and the instruction hash.
+        """
+        instruction_hash = hashlib.sha256(system_instruction.encode("utf-8"))
+        return video_id, instruction_hash.hexdigest()[:16]
+
+    def mark(self, key, state):
+        """Sets the state of the key without a cached content.
+        The least recently marked keys are forgotten above max_seen.
+
+        Args:
+            key (tuple[str, str]): Cache key.
+            state (str): "requested", "creating" or "failed".
+        """
+        self.seen[key] = state
+        self.seen.move_to_end(key)
+        while len(self.seen) > self.max_seen:
+            self.seen.popitem(last=False)
+
+    def get_or_create(self, video_id, system_instruction, transcript):
+        """Returns the cached content for the video, creating it on the second request.
+
+        Args:
+            video_id (str): YouTube video ID.
+            system_instruction (str): System instruction of the model.
+            transcript (str): Video transcript.
+
+        Returns:
+            Any: Backend handle of the cached content or None if it's not cached.
+        """
+        key = self.create_key(video_id, system_instruction)
+        with self.lock:
+            now = self.clock()
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires_at"] > now:
+                self.entries.move_to_end(key)
+                refresh = entry["expires_at"] - now < self.ttl / 2
+                if refresh:
+                    entry["expires_at"] = now + self.ttl
+                handle = entry["handle"]
+            else:
+                self.entries.pop(key, None)
+                handle = None
+                # Expired entries were used before, so they are created right away
+                state = "requested" if entry is not None else self.seen.get(key)
+                if state is None:
+                    self.mark(key, "requested")
+                    return None
+                if state != "requested":
+                    return None
+                self.mark(key, "creating")
+
+        if handle is not None:
+            if refresh:
+                try:
+                    self.backend.refresh(handle, self.ttl)
+                except exceptions.NotFound:
+                    self.forget(key, handle)
+                    return None
+            logging.info("Using cached context for video %s", video_id)
+            return handle
+
+        try:
+            handle = self.backend.create(
+                self.model, system_instruction, [transcript], self.ttl
+            )
+        except exceptions.BadRequest as exc:
+            # Rejected contents (e.g. below the minimum size) would be rejected again
+            logging.info("Cached context of video %s rejected: %s", video_id, exc)
+            with self.lock:
+                self.mark(key, "failed")
+            return None
+        except Exception:
+            with self.lock:
+                self.mark(key, "requested")
+            raise
+        with self.lock:
+            self.seen.pop(key, None)
+            expires_at = self.clock() + self.ttl
+            self.entries[key] = {"handle": handle, "expires_at": expires_at}
+            evicted = []
+            while len(self.entries) > self.max_entries:
+                evicted.append(self.entries.popitem(last=False)[1]["handle"])
+        logging.info("Created cached context for video %s", video_id)
+        for evicted_handle in evicted:
+            self.delete(evicted_handle)
+        return handle
+
+    def forget(self, key, handle):
+        """Drops the entry whose cached content is gone, so it's created on next use.
+
+        Args:
+            key (tuple[str, str]): Cache key.
+            handle (Any): Backend handle of the missing cached content.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["handle"] is handle:
+                del self.entries[key]
+            self.mark(key, "requested")
+
+    def generate(self, video_id, system_instruction, transcript, prompt):
+        """Generates the response using the cached transcript and instruction.
+        If the cached content disappeared from the server, it is created again.
+
+        Args:
+            video_id (str): YouTube video ID.
+            system_instruction (str): System instruction of the model.
+            transcript (str): Video transcript.
+            prompt (str): Prompt sent with the cached content.
+
+        Returns:
+            str | None: Response text or None if the video is not cached.
+        """
+        key = self.create_key(video_id, system_instruction)
+        handle = self.get_or_create(video_id, system_instruction, transcript)
+        if handle is None:
+            return None
+        try:
+            return self.backend.generate(
+                handle, prompt, app_parameters.GEMINI_LLM_CONFIG
+            )
+        except exceptions.NotFound as exc:
+            logging.warning("Cached context of video %s is gone: %s", video_id, exc)
+            self.forget(key, handle)
+        handle = self.get_or_create(video_id, system_instruction, transcript)
+        if handle is None:
+            return None
+        return self.backend.generate(handle, prompt, app_parameters.GEMINI_LLM_CONFIG)
+
+    def evict(self, video_id):
+        """Deletes cached contents of the video.
+
+        Args:
+            video_id (str): YouTube video ID.
+        """
+        with self.lock:
+            keys = [key for key in self.entries if key[0] == video_id]
+            evicted = [self.entries.pop(key)["handle"] for key in keys]
+        for handle in evicted:
+            self.delete(handle)
+
+    def clear(self):
+        """Deletes all cached contents created by this cache."""
+        with self.lock:
+            evicted = [entry["handle"] for entry in self.entries.values()]
+            self.entries.clear()
+            self.seen.clear()
+        for handle in evicted:
+            self.delete(handle)
+
+    def delete(self, handle):
+        """Deletes the cached content, ignoring already expired ones."""
+        try:
+            self.backend.delete(handle)
+        except Exception as exc:
+            logging.info("Failed to delete cached context: %s", exc)
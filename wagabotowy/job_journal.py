@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+class JobJournal:
+    """Append-only journal of started and finished bot jobs.
+
+    Every started job is written (and flushed to disk) before the work begins,
+    every finished one gets a "done" record. Jobs without the "done" record
+    were interrupted and can be replayed after the restart. Compaction rewrites
+    the journal with the pending jobs only. The methods wait for fsync, so the
+    bot calls them from a worker thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = {}
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.load()
+        self.compact()
+
+    def load(self):
+        """Reads the journal and collects jobs which were not finished."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut when the process was killed while writing
+                    logging.warning("Skipping broken job journal line: %s", line)
+                    continue
+                if record["event"] == "start":
+                    self.pending[record["message_id"]] = record
+                else:
+                    self.pending.pop(record["message_id"], None)
+        logging.info("Job journal loaded, %s unfinished jobs", len(self.pending))
+
+    def append(self, record):
+        """Writes the record and flushes it to disk.
+
+        Args:
+            record (dict): Journal record.
+        """
+        with open(self.path, "a", encoding="utf-8") as journal_file:
+            journal_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def start(self, command, channel_id, message_id):
+        """Records the started job. Replayed jobs are not recorded twice.
+
+        Args:
+            command (str): Command name.
+            channel_id (int): Discord channel ID.
+            message_id (int): ID of the message which invoked the command.
+        """
+        with self.lock:
+            if message_id in self.pending:
+                return
+            record = {
+                "event": "start",
+                "command": command,
+                "channel_id": channel_id,
+                "message_id": message_id,
+                "started_at": time.time(),
+            }
+            self.append(record)
+            self.pending[message_id] = record
+
+    def finish(self, message_id):
+        """Records the finished job.
+
+        Args:
+            message_id (int): ID of the message which invoked the command.
+        """
+        with self.lock:
+            if self.pending.pop(message_id, None) is None:
+                return
+            self.append({"event": "done", "message_id": message_id})
+
+    def compact(self):
+        """Rewrites the journal with the pending jobs only."""
+        with self.lock:
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as journal_file:
+                for record in self.pending.values():
+                    journal_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            os.replace(temporary_path, self.path)
+
+    def unfinished_jobs(self):
+        """Returns jobs which were started and not finished.
+
+        Returns:
+            list[dict]: Start records from the oldest.
+        """
+        with self.lock:
+            return sorted(self.pending.values(), key=lambda record: record["started_at"])
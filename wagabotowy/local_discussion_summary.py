@@ -2,16 +2,16 @@ import re
 import logging
 
 import app_parameters
+from ollama_pool import chat_stream
 
-from ollama import chat, ChatResponse
 
-
-def generate_summary(model, content):
+def generate_summary(model, content, num_ctx):
     """Generates the summary using Bielik model. Currently supporting only Polish language.
 
     Args:
         model (str): Bielik LLM.
         content (str): Cleaned Discord discussion.
+        num_ctx (int): Context size of the model.
 
     Returns:
         str: Summary of the discussion.
@@ -27,14 +27,15 @@ def generate_summary(model, content):
             "content": f"Rozmowa:{content}",
         },
     ]
-    response: ChatResponse = chat(
-        model=model,
-        stream=False,
+    # Streamed, so the generation can be stopped by the shutdown
+    stream = chat_stream(
+        model,
         messages=messages,
-        options={"num_ctx": 8192, "top_k": 10, "temperature": 0.2, "num_predict": 500},
+        options={**app_parameters.SETTINGS_DISCUSSION_SUMMARY, "num_ctx": num_ctx},
     )
-    logging.info(response["message"]["content"])
-    return response["message"]["content"]
+    summary = "".join(chunk["message"]["content"] for chunk in stream)
+    logging.info(summary)
+    return summary
 
 
 def clean_discussion_string(content):
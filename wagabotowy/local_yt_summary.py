@@ -2,17 +2,19 @@ import re
 
 import custom_exceptions as e
 import app_parameters
+from reasoning_stream import generate_with_reasoning_control
 
 from youtube_transcript_api import YouTubeTranscriptApi
-from ollama import chat, ChatResponse
 
 
-def generate_pl_summary(model, transcript):
+def generate_pl_summary(model, transcript, reasoning_mode, num_ctx):
     """Creates the LLM Polish response which summarizes the given transcript.
 
     Args:
         model (str): Model goot at Polish.
         transcript (str): Transcript pulled from YouTubeTranscriptAPI.
+        reasoning_mode (str): Reasoning mode of the model ("off", "capped" or "full").
+        num_ctx (int): Context size of the model.
 
     Returns:
         str: Summary of the transcript created by the model.
@@ -29,26 +31,24 @@ def generate_pl_summary(model, transcript):
         },
     ]
 
-    response: ChatResponse = chat(
-        model=model,
-        stream=False,
-        messages=messages,
-        options=app_parameters.SETTINGS_YT_SUMMARY,
-    )
-    pattern = "<think>.*?</think>"
-    valid_response = re.sub(
-        pattern, "", response["message"]["content"], flags=re.DOTALL
+    valid_response = generate_with_reasoning_control(
+        model,
+        messages,
+        {**app_parameters.SETTINGS_YT_SUMMARY, "num_ctx": num_ctx},
+        reasoning_mode,
     )
     print(valid_response[:2000])
-    return valid_response[:2000]
+    return valid_response
 
 
-def generate_en_summary(model, transcript):
+def generate_en_summary(model, transcript, reasoning_mode, num_ctx):
     """Creates the LLM response which summarizes the given transcript
 
     Args:
         model (str): Used model.
         transcript (str): Transcript pulled from YouTubeTranscriptAPI.
+        reasoning_mode (str): Reasoning mode of the model ("off", "capped" or "full").
+        num_ctx (int): Context size of the model.
 
     Returns:
         str: Summary of the transcript created by the model.
@@ -65,12 +65,11 @@ def generate_en_summary(model, transcript):
         },
     ]
 
-    response: ChatResponse = chat(
-        model=model, messages=messages, options=app_parameters.SETTINGS_YT_SUMMARY
-    )
-    pattern = "<think>.*?</think>"
-    valid_response = re.sub(
-        pattern, "", response["message"]["content"], flags=re.DOTALL
+    valid_response = generate_with_reasoning_control(
+        model,
+        messages,
+        {**app_parameters.SETTINGS_YT_SUMMARY, "num_ctx": num_ctx},
+        reasoning_mode,
     )
     print(valid_response[:2000])
     return valid_response
@@ -125,28 +124,27 @@ def create_transcript(text_with_yt_link):
     return final_transcript, transcript_language
 
 
-def generate_summary(message_with_yt_link, ez_mode):
+def generate_summary(message_with_yt_link, selector, reasoning_mode):
     """Summarizes the YouTube video linked in the message.
 
     Args:
         message (str): Message with YouTube video link.
-        args: Uses the smaller model when ez_mode flag is on.
+        selector (model_selector.ModelSelector): Chooses the model for the transcript.
+        reasoning_mode (str): Reasoning mode of the model ("off", "capped" or "full").
 
     Returns:
         str: Video summary.
     """
     transcript, language = create_transcript(message_with_yt_link)
-    if ez_mode:
-        model_size = "ez"
-    else:
-        model_size = "normal"
     if language.startswith("Polish"):
-        summary = generate_pl_summary(
-            app_parameters.MODEL_YT_SUMMARY_PL_LOCAL[model_size], transcript
-        )
+        with selector.run("youtube", transcript) as choice:
+            summary = generate_pl_summary(
+                choice.model, transcript, reasoning_mode, choice.num_ctx
+            )
         return summary
     if language.startswith("English"):
-        summary = generate_en_summary(
-            app_parameters.MODEL_YT_SUMMARY_PL_LOCAL[model_size], transcript
-        )
+        with selector.run("youtube", transcript) as choice:
+            summary = generate_en_summary(
+                choice.model, transcript, reasoning_mode, choice.num_ctx
+            )
         return summary
@@ -0,0 +1,120 @@
+import asyncio
+import bisect
+import logging
+import sys
+import threading
+import time
+import traceback
+
+import app_parameters
+
+
+class LoopWatchdog:
+    """Measures the event loop scheduling lag and logs stacks of blocking callbacks.
+
+    The probe task sleeps for a fixed interval and records how late it woke up.
+    A separate thread checks when the probe last ran - if the loop is stuck for
+    longer than the threshold, it logs the stack of the event loop thread,
+    which shows the synchronous code blocking the loop.
+    """
+
+    def __init__(
+        self,
+        interval=app_parameters.LOOP_WATCHDOG["interval"],
+        threshold=app_parameters.LOOP_WATCHDOG["threshold"],
+        report_interval=app_parameters.LOOP_WATCHDOG["report_interval"],
+        buckets=app_parameters.LOOP_WATCHDOG["buckets"],
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.buckets = tuple(buckets)
+        self.histogram = [0] * (len(self.buckets) + 1)
+        self.max_lag = 0.0
+        self.last_beat = time.monotonic()
+        self.loop_thread_id = None
+        self.probe_task = None
+        self.stop_event = threading.Event()
+        self.sampler_thread = None
+
+    def start(self, loop):
+        """Starts the probe task and the stack sampler thread.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): Watched event loop.
+        """
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.probe_task = loop.create_task(self.probe())
+        self.sampler_thread = threading.Thread(
+            target=self.sample_stacks, name="loop-watchdog", daemon=True
+        )
+        self.sampler_thread.start()
+        logging.info(
+            "Loop watchdog started (interval: %s s, threshold: %s s)",
+            self.interval,
+            self.threshold,
+        )
+
+    def stop(self):
+        """Stops the watchdog and logs the final lag histogram."""
+        self.stop_event.set()
+        if self.probe_task is not None:
+            self.probe_task.cancel()
+        self.report()
+
+    def record(self, lag):
+        """Adds the lag to the histogram.
+
+        Args:
+            lag (float): Scheduling delay in seconds.
+        """
+        self.histogram[bisect.bisect_left(self.buckets, lag)] += 1
+        self.max_lag = max(self.max_lag, lag)
+
+    def report(self):
+        """Logs the lag histogram and the maximum lag since the last report."""
+        labels = [f"<={bucket}s" for bucket in self.buckets]
+        labels.append(f">{self.buckets[-1]}s")
+        histogram = ", ".join(
+            f"{label}: {count}" for label, count in zip(labels, self.histogram)
+        )
+        logging.info(
+            "Event loop lag histogram: %s; max lag: %.3f s", histogram, self.max_lag
+        )
+        self.histogram = [0] * (len(self.buckets) + 1)
+        self.max_lag = 0.0
+
+    async def probe(self):
+        """Measures how late the event loop wakes up the sleeping task."""
+        last_report = time.monotonic()
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_beat = now
+            lag = now - start - self.interval
+            self.record(lag)
+            if lag > self.threshold:
+                logging.warning("Event loop lag: %.3f s", lag)
+            if now - last_report >= self.report_interval:
+                self.report()
+                last_report = now
+
+    def sample_stacks(self):
+        """Logs the event loop thread stack when the probe task is late."""
+        reported_beat = None
+        while not self.stop_event.wait(self.threshold / 2):
+            stuck_for = time.monotonic() - self.last_beat - self.interval
+            if stuck_for <= self.threshold or reported_beat == self.last_beat:
+                continue
+            reported_beat = self.last_beat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            logging.warning(
+                "Event loop blocked for %.3f s, loop thread stack:\n%s",
+                stuck_for,
+                stack,
+            )
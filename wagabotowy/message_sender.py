@@ -0,0 +1,119 @@
+import asyncio
+import io
+import logging
+import re
+
+import discord
+
+import app_parameters
+
+
+# HTTP status after which Discord didn't create the message, so sending it again
+# can't post it twice. discord.py already retries 500, 502, 504 and 524 itself,
+# and after those (or timeouts) the message may have been created.
+RETRY_STATUS = 503
+
+# Separator patterns and the strings joining the units back, from the biggest
+# to the smallest text unit: paragraphs, lines (bullet points), sentences and words
+SPLIT_PATTERNS = (
+    (r"\n\s*\n", "\n\n"),
+    (r"\n", "\n"),
+    (r"(?<=[.!?])\s+", " "),
+    (r"\s+", " "),
+)
+
+
+def split_text(text, limit, patterns=SPLIT_PATTERNS):
+    """Splits the text into parts not longer than the limit.
+    Uses the biggest text unit which fits, so paragraphs and bullet points stay whole.
+
+    Args:
+        text (str): Text to split.
+        limit (int): Maximum part length.
+        patterns (tuple[tuple[str, str]]): Separator patterns and joiners.
+
+    Returns:
+        list[str]: Parts of the text.
+    """
+    text = text.strip()
+    if len(text) <= limit:
+        return [text] if text else []
+    if not patterns:
+        return [text[i : i + limit] for i in range(0, len(text), limit)]
+    pattern, separator = patterns[0]
+    parts = []
+    current = ""
+    for unit in re.split(pattern, text):
+        unit = unit.rstrip()
+        if not unit.strip():
+            continue
+        if len(unit) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.extend(split_text(unit, limit, patterns[1:]))
+        elif not current:
+            current = unit
+        elif len(current) + len(separator) + len(unit) <= limit:
+            current = f"{current}{separator}{unit}"
+        else:
+            parts.append(current)
+            current = unit
+    if current:
+        parts.append(current)
+    return parts
+
+
+async def send_with_retry(ctx, create_kwargs):
+    """Sends the message, retrying 503 responses with exponential backoff.
+
+    Args:
+        ctx (commands.Context): Command context.
+        create_kwargs (callable): Returns fresh ctx.send keyword arguments for each try.
+
+    Returns:
+        discord.Message: Sent message.
+    """
+    retries = app_parameters.DISCORD_OUTPUT["send_retries"]
+    delay = app_parameters.DISCORD_OUTPUT["retry_delay"]
+    for attempt in range(retries + 1):
+        try:
+            return await ctx.send(**create_kwargs())
+        except discord.errors.DiscordServerError as exc:
+            if exc.status != RETRY_STATUS or attempt == retries:
+                raise
+            logging.warning(
+                "Sending the message failed (%s), retrying in %s s", exc, delay
+            )
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+async def send_long_message(ctx, text):
+    """Sends the LLM response, split into several messages or attached as a file.
+
+    Args:
+        ctx (commands.Context): Command context.
+        text (str): Text to send.
+    """
+    limit = app_parameters.DISCORD_OUTPUT["message_limit"]
+    parts = split_text(text, limit)
+    logging.info("Sending %s characters in %s parts", len(text), len(parts))
+    if not parts:
+        await send_with_retry(
+            ctx, lambda: {"content": "Nic mi nie wyszło, spróbuj jeszcze raz."}
+        )
+        return
+    if len(parts) > app_parameters.DISCORD_OUTPUT["max_messages"]:
+        await send_with_retry(
+            ctx,
+            lambda: {
+                "content": "Wyszło trochę długo, więc wrzucam w pliku.",
+                "file": discord.File(
+                    io.BytesIO(text.encode("utf-8")), filename="podsumowanie.txt"
+                ),
+            },
+        )
+        return
+    for part in parts:
+        await send_with_retry(ctx, lambda part=part: {"content": part})
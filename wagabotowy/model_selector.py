@@ -0,0 +1,307 @@
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+import app_parameters
+
+
+ModelChoice = collections.namedtuple(
+    "ModelChoice", ["task", "tier", "model", "num_ctx", "input_tokens", "queue_depth"]
+)
+
+# Models, output token budgets and the longest system instructions of the local tasks
+TASKS = {
+    "discussion": (
+        app_parameters.MODEL_DISCORD_SUMMARY_LOCAL,
+        app_parameters.SETTINGS_DISCUSSION_SUMMARY["num_predict"],
+        app_parameters.BIELIK_SYS_INSTRUCTION_DISCUSSION_SUMMARY,
+    ),
+    "youtube": (
+        app_parameters.MODEL_YT_SUMMARY_PL_LOCAL,
+        app_parameters.SETTINGS_YT_SUMMARY["num_predict"]
+        + app_parameters.REASONING_LOCAL["max_tokens"],
+        max(
+            app_parameters.BIELIK_SYS_INSTRUCTION_YT,
+            app_parameters.DEEPSEEK_SYS_INSTRUCTION_YT,
+            key=len,
+        ),
+    ),
+}
+
+
+class ModelSelector:
+    """Chooses the local model tier and context size for every request.
+
+    The bigger ("normal") model is used when its predicted latency fits the
+    latency SLO. The service time of a tier is modelled as a fixed cost (model
+    overhead and generating the output) plus a cost per input token, fitted on
+    recent measurements. Measured latencies are divided by the queue the request
+    waited in, and the prediction multiplies the service time by the current
+    queue, so queueing is counted once. Without enough recent measurements the
+    defaults from app_parameters are used. While the "normal" tier is predicted
+    over the SLO, it gets one request per probe interval, so a stale or wrong
+    prediction doesn't keep requests on the "ez" tier. Requests are never used
+    for probing when the "normal" tier fits the SLO.
+    """
+
+    def __init__(
+        self,
+        latency_slo=app_parameters.MODEL_SELECTION["latency_slo"],
+        pinned_tier=None,
+        clock=time.monotonic,
+    ):
+        self.latency_slo = latency_slo
+        self.pinned_tier = pinned_tier
+        self.clock = clock
+        self.in_flight = 0
+        self.samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=app_parameters.MODEL_SELECTION["history"])
+        )
+        # Without measurements the defaults are trusted for one probe interval
+        self.started = self.clock()
+        self.last_used = {}
+        self.last_probe = {}
+        self.lock = threading.Lock()
+
+    def service_time_model(self, task, tier):
+        """Returns the fixed cost and the cost per input token of the tier.
+
+        Args:
+            task (str): Task name from TASKS.
+            tier (str): Model tier, "normal" or "ez".
+
+        Returns:
+            tuple[float, float]: Fixed seconds and seconds per input token.
+        """
+        parameters = app_parameters.MODEL_SELECTION
+        _, output_tokens, _ = TASKS[task]
+        default_fixed = (
+            parameters["fixed_seconds"][tier]
+            + output_tokens / parameters["output_tokens_per_second"][tier]
+        )
+        default_per_token = parameters["seconds_per_1k_input_tokens"][tier] / 1000
+        samples = self.samples[(task, tier)]
+        oldest = self.clock() - parameters["sample_max_age"]
+        while samples and samples[0][0] < oldest:
+            samples.popleft()
+        return fit_service_time(
+            [(tokens, seconds) for _, tokens, seconds in samples],
+            default_fixed,
+            default_per_token,
+        )
+
+    def predict_latency(self, task, tier, input_tokens, queue_depth):
+        """Predicts the request latency including requests running before it.
+
+        Args:
+            task (str): Task name from TASKS.
+            tier (str): Model tier, "normal" or "ez".
+            input_tokens (int): Estimated input size.
+            queue_depth (int): Number of requests already running.
+
+        Returns:
+            float: Predicted latency in seconds.
+        """
+        fixed, per_token = self.service_time_model(task, tier)
+        return (fixed + per_token * input_tokens) * queue_factor(queue_depth)
+
+    def select(self, task, text):
+        """Chooses the model for the request and counts it as running.
+
+        Args:
+            task (str): Task name from TASKS.
+            text (str): Model input.
+
+        Returns:
+            ModelChoice: Chosen model and context size.
+        """
+        models, output_tokens, system_instruction = TASKS[task]
+        input_tokens = estimate_tokens(text)
+        with self.lock:
+            now = self.clock()
+            queue_depth = self.in_flight
+            predicted = {
+                tier: self.predict_latency(task, tier, input_tokens, queue_depth)
+                for tier in models
+            }
+            if self.pinned_tier is not None:
+                tier = self.pinned_tier
+                reason = "pinned"
+            elif predicted["normal"] <= self.latency_slo:
+                tier = "normal"
+                reason = "fits SLO"
+            elif self.should_probe(task, now):
+                tier = "normal"
+                reason = "probe"
+                self.last_probe[task] = now
+            else:
+                tier = "ez"
+                reason = "over SLO"
+            self.last_used[(task, tier)] = now
+            self.in_flight += 1
+        choice = ModelChoice(
+            task,
+            tier,
+            models[tier],
+            context_size(
+                estimate_tokens(system_instruction) + input_tokens + output_tokens
+            ),
+            input_tokens,
+            queue_depth,
+        )
+        logging.info(
+            "Model selection: task=%s tier=%s (%s) model=%s num_ctx=%s "
+            "input_tokens=%s queue_depth=%s predicted_normal=%.1fs "
+            "predicted_ez=%.1fs slo=%ss",
+            task,
+            tier,
+            reason,
+            choice.model,
+            choice.num_ctx,
+            input_tokens,
+            queue_depth,
+            predicted["normal"],
+            predicted["ez"],
+            self.latency_slo,
+        )
+        return choice
+
+    def should_probe(self, task, now):
+        """Checks if the "normal" tier predicted over the SLO should be measured.
+
+        Args:
+            task (str): Task name from TASKS.
+            now (float): Current clock value.
+
+        Returns:
+            bool: True if neither a probe nor any request used the tier recently.
+        """
+        probe_interval = app_parameters.MODEL_SELECTION["probe_interval"]
+        last_probe = self.last_probe.get(task, self.started)
+        last_used = self.last_used.get((task, "normal"), self.started)
+        return now - max(last_probe, last_used) >= probe_interval
+
+    def finish(self, choice, seconds, succeeded):
+        """Marks the request as finished and records its service time.
+
+        Args:
+            choice (ModelChoice): Model chosen for the request.
+            seconds (float): Request latency.
+            succeeded (bool): False if the request failed, its latency is skipped.
+        """
+        with self.lock:
+            self.in_flight -= 1
+            if succeeded:
+                self.samples[(choice.task, choice.tier)].append(
+                    (
+                        self.clock(),
+                        choice.input_tokens,
+                        seconds / queue_factor(choice.queue_depth),
+                    )
+                )
+        logging.info(
+            "Model selection result: task=%s tier=%s latency=%.1fs succeeded=%s",
+            choice.task,
+            choice.tier,
+            seconds,
+            succeeded,
+        )
+
+    @contextlib.contextmanager
+    def run(self, task, text):
+        """Chooses the model and measures the request latency.
+
+        Args:
+            task (str): Task name from TASKS.
+            text (str): Model input.
+
+        Yields:
+            ModelChoice: Chosen model and context size.
+        """
+        choice = self.select(task, text)
+        start = time.monotonic()
+        succeeded = False
+        try:
+            yield choice
+            succeeded = True
+        finally:
+            self.finish(choice, time.monotonic() - start, succeeded)
+
+
+def queue_factor(queue_depth):
+    """Returns how many service times the request takes with the queue before it.
+
+    Args:
+        queue_depth (int): Number of requests running before the request.
+
+    Returns:
+        float: Latency to service time ratio.
+    """
+    return 1 + queue_depth / app_parameters.MODEL_SELECTION["parallel_requests"]
+
+
+def fit_service_time(samples, default_fixed, default_per_token):
+    """Fits the fixed cost and the cost per input token to the measurements.
+    With few samples or inputs of similar size the defaults are scaled to match
+    the measured average, keeping their ratio.
+
+    Args:
+        samples (list[tuple[int, float]]): Input tokens and service times.
+        default_fixed (float): Fixed seconds used without samples.
+        default_per_token (float): Seconds per input token used without a fit.
+
+    Returns:
+        tuple[float, float]: Fixed seconds and seconds per input token.
+    """
+    if not samples:
+        return default_fixed, default_per_token
+    mean_tokens = sum(tokens for tokens, _ in samples) / len(samples)
+    mean_seconds = sum(seconds for _, seconds in samples) / len(samples)
+    variance = sum((tokens - mean_tokens) ** 2 for tokens, _ in samples)
+    # Inputs differing by less than ~500 tokens don't tell the input cost apart
+    if len(samples) >= 3 and variance / len(samples) >= 500**2:
+        covariance = sum(
+            (tokens - mean_tokens) * (seconds - mean_seconds)
+            for tokens, seconds in samples
+        )
+        per_token = covariance / variance
+        fixed = mean_seconds - per_token * mean_tokens
+        if per_token > 0 and fixed >= 0:
+            return fixed, per_token
+    scale = mean_seconds / (default_fixed + default_per_token * mean_tokens)
+    return default_fixed * scale, default_per_token * scale
+
+
+def estimate_tokens(text):
+    """Estimates the number of tokens of the text.
+
+    Args:
+        text (str): Model input.
+
+    Returns:
+        int: Estimated number of tokens, at least 1.
+    """
+    return max(1, len(text) // app_parameters.MODEL_SELECTION["chars_per_token"])
+
+
+def context_size(tokens):
+    """Rounds the needed context up to the power of two within the configured limits.
+    The chat template tokens and the safety margin for the token estimate are added
+    first, so the input isn't truncated by Ollama.
+
+    Args:
+        tokens (int): System instruction, input and output tokens.
+
+    Returns:
+        int: num_ctx value.
+    """
+    limits = app_parameters.MODEL_SELECTION["num_ctx"]
+    tokens = (
+        tokens + app_parameters.MODEL_SELECTION["template_tokens"]
+    ) * app_parameters.MODEL_SELECTION["context_margin"]
+    num_ctx = limits["min"]
+    while num_ctx < tokens and num_ctx < limits["max"]:
+        num_ctx *= 2
+    return min(num_ctx, limits["max"])
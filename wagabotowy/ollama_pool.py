@@ -0,0 +1,324 @@
+import logging
+import threading
+
+import app_parameters
+import custom_exceptions as e
+
+from ollama import Client
+
+
+class OllamaEndpoint:
+    """Single Ollama host with persistent HTTP clients and its current state.
+    Health checks use a separate client with a short timeout, so they don't wait
+    as long as generation requests.
+    """
+
+    def __init__(self, host, timeout, health_check_timeout):
+        self.host = host
+        self.client = Client(host=host, timeout=timeout)
+        self.health_client = Client(host=host, timeout=health_check_timeout)
+        self.in_flight = 0
+        self.loaded_models = set()
+        self.healthy = True
+
+
+class OllamaPool:
+    """Pool of Ollama hosts used by the local mode.
+
+    Requests are routed to a healthy host which already has the model loaded
+    (model affinity), choosing the least loaded one. If no host has the model
+    loaded, the least loaded healthy host is used. Hosts failing requests are
+    marked unhealthy, a background thread checks all hosts every health check
+    interval and brings them back. Hosts without the requested model (404) are
+    skipped and the next host is tried. After cancel() no new requests are
+    started and running streams are closed, which stops the generation.
+    """
+
+    def __init__(
+        self,
+        hosts=app_parameters.OLLAMA_POOL["hosts"],
+        timeout=app_parameters.OLLAMA_POOL["timeout"],
+        health_check_interval=app_parameters.OLLAMA_POOL["health_check_interval"],
+        health_check_timeout=app_parameters.OLLAMA_POOL["health_check_timeout"],
+    ):
+        if not hosts:
+            raise ValueError("At least one Ollama host is required")
+        self.endpoints = [
+            OllamaEndpoint(host, timeout, health_check_timeout) for host in hosts
+        ]
+        self.health_check_interval = health_check_interval
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.stop_event = threading.Event()
+        self.health_thread = threading.Thread(
+            target=self.run_health_checks, name="ollama-health", daemon=True
+        )
+        self.health_thread.start()
+
+    def close(self):
+        """Stops the background health checks."""
+        self.stop_event.set()
+
+    def cancel(self):
+        """Stops running generations and rejects new requests."""
+        self.cancelled.set()
+
+    def check_cancelled(self):
+        """Raises the error if the pool was cancelled.
+
+        Raises:
+            e.GenerationCancelledError: The pool was cancelled.
+        """
+        if self.cancelled.is_set():
+            raise e.GenerationCancelledError("Generation cancelled by the shutdown")
+
+    def run_health_checks(self):
+        """Checks all hosts every health check interval, outside the request path."""
+        while True:
+            for endpoint in self.endpoints:
+                self.check_health(endpoint)
+            if self.stop_event.wait(self.health_check_interval):
+                return
+
+    def check_health(self, endpoint):
+        """Checks if the host responds and refreshes the list of loaded models.
+
+        Args:
+            endpoint (OllamaEndpoint): Checked host.
+        """
+        try:
+            running = endpoint.health_client.ps()
+        except Exception as exc:
+            with self.lock:
+                endpoint.healthy = False
+            logging.warning("Ollama host %s is not healthy: %s", endpoint.host, exc)
+            return
+        with self.lock:
+            if not endpoint.healthy:
+                logging.info("Ollama host %s is healthy again", endpoint.host)
+            endpoint.healthy = True
+            endpoint.loaded_models = {model.model for model in running.models}
+
+    def acquire(self, model, tried):
+        """Chooses the host for the request and marks it as busy.
+
+        Args:
+            model (str): Requested model.
+            tried (set[str]): Hosts already tried for this request.
+
+        Raises:
+            e.OllamaNotWorkingError: No healthy Ollama host is available.
+
+        Returns:
+            OllamaEndpoint | None: Chosen host or None if every healthy host was tried.
+        """
+        with self.lock:
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+            if not healthy:
+                raise e.OllamaNotWorkingError("No healthy Ollama host available")
+            candidates = [
+                endpoint for endpoint in healthy if endpoint.host not in tried
+            ]
+            if not candidates:
+                return None
+            with_model = [
+                endpoint for endpoint in candidates if model in endpoint.loaded_models
+            ]
+            endpoint = min(with_model or candidates, key=lambda item: item.in_flight)
+            endpoint.in_flight += 1
+        tried.add(endpoint.host)
+        logging.debug(
+            "Routing %s to Ollama host %s (in flight: %s)",
+            model,
+            endpoint.host,
+            endpoint.in_flight,
+        )
+        return endpoint
+
+    def release(self, endpoint, model, error=None):
+        """Marks the request on the host as finished.
+
+        Args:
+            endpoint (OllamaEndpoint): Host which handled the request.
+            model (str): Used model.
+            error (Exception | None): Error raised by the request, None on success.
+        """
+        with self.lock:
+            endpoint.in_flight -= 1
+            if error is None:
+                endpoint.loaded_models.add(model)
+            elif is_model_missing(error):
+                endpoint.loaded_models.discard(model)
+            elif is_host_error(error):
+                endpoint.healthy = False
+
+    def next_host_error(self, endpoint, model, exc):
+        """Checks if the request should be retried on the next host.
+
+        Args:
+            endpoint (OllamaEndpoint): Host which failed.
+            model (str): Used model.
+            exc (Exception): Error raised by the request.
+
+        Returns:
+            bool: True for host errors and a missing model.
+        """
+        if is_model_missing(exc):
+            logging.warning("Ollama host %s doesn't have %s", endpoint.host, model)
+            return True
+        if is_host_error(exc):
+            logging.warning("Ollama host %s failed: %s", endpoint.host, exc)
+            return True
+        return False
+
+    def request(self, method, model, **kwargs):
+        """Runs the client method on the chosen host, retrying on other hosts.
+
+        Args:
+            method (str): Name of the ollama.Client method, e.g. "chat".
+            model (str): Requested model.
+
+        Raises:
+            e.OllamaNotWorkingError: Every host failed.
+            ollama.ResponseError: No host has the model.
+
+        Returns:
+            Any: Response of the client method.
+        """
+        self.check_cancelled()
+        tried = set()
+        last_error = e.OllamaNotWorkingError("Every Ollama host failed")
+        while (endpoint := self.acquire(model, tried)) is not None:
+            try:
+                response = getattr(endpoint.client, method)(model=model, **kwargs)
+            except Exception as exc:
+                self.release(endpoint, model, exc)
+                if not self.next_host_error(endpoint, model, exc):
+                    raise
+                last_error = exc if is_model_missing(exc) else last_error
+                continue
+            self.release(endpoint, model)
+            return response
+        raise last_error
+
+    def chat(self, model, **kwargs):
+        """Works like ollama.chat, but on the chosen host."""
+        return self.request("chat", model, **kwargs)
+
+    def embed(self, model, **kwargs):
+        """Works like ollama.embed, but on the chosen host."""
+        return self.request("embed", model, **kwargs)
+
+    def chat_stream(self, model, **kwargs):
+        """Works like ollama.chat with stream=True, but on the chosen host.
+        The host is marked as busy until the stream is exhausted or closed,
+        closing the stream early stops the generation on the host.
+
+        Raises:
+            e.OllamaNotWorkingError: Every host failed before streaming anything.
+            e.GenerationCancelledError: The pool was cancelled.
+            ollama.ResponseError: No host has the model.
+
+        Yields:
+            ChatResponse: Response chunks.
+        """
+        self.check_cancelled()
+        tried = set()
+        last_error = e.OllamaNotWorkingError("Every Ollama host failed")
+        while (endpoint := self.acquire(model, tried)) is not None:
+            started = False
+            error = None
+            stream = endpoint.client.chat(model=model, stream=True, **kwargs)
+            try:
+                for chunk in stream:
+                    started = True
+                    self.check_cancelled()
+                    yield chunk
+                return
+            except Exception as exc:
+                error = exc
+                if started or not self.next_host_error(endpoint, model, exc):
+                    raise
+                last_error = exc if is_model_missing(exc) else last_error
+            finally:
+                stream.close()
+                self.release(endpoint, model, error)
+        raise last_error
+
+
+def is_model_missing(exc):
+    """Checks if the host doesn't have the requested model.
+
+    Args:
+        exc (Exception): Exception raised by the client.
+
+    Returns:
+        bool: True when the host responded with 404.
+    """
+    return getattr(exc, "status_code", None) == 404
+
+
+def is_host_error(exc):
+    """Checks if the exception was caused by the host, not by the request.
+
+    Args:
+        exc (Exception): Exception raised by the client.
+
+    Returns:
+        bool: True for connection errors, timeouts and server errors.
+    """
+    status_code = getattr(exc, "status_code", None)
+    if status_code is not None:
+        return status_code >= 500
+    return isinstance(exc, (ConnectionError, TimeoutError)) or type(
+        exc
+    ).__module__.startswith(("httpx", "httpcore"))
+
+
+pool = None
+
+
+def get_pool():
+    """Returns the shared Ollama pool, creating it on first use.
+
+    Returns:
+        OllamaPool: Shared pool.
+    """
+    global pool
+    if pool is None:
+        pool = OllamaPool()
+    return pool
+
+
+def configure_pool(hosts):
+    """Creates the shared Ollama pool with the given hosts.
+
+    Args:
+        hosts (list[str]): Ollama host URLs.
+    """
+    global pool
+    if pool is not None:
+        pool.close()
+    pool = OllamaPool(hosts=hosts)
+    logging.info("Ollama hosts: %s", ", ".join(hosts))
+
+
+def cancel_generation():
+    """Stops running local generations, used when the bot shuts down."""
+    if pool is not None:
+        pool.cancel()
+
+
+def chat(model, **kwargs):
+    """Works like ollama.chat, but uses the shared Ollama pool."""
+    return get_pool().chat(model, **kwargs)
+
+
+def chat_stream(model, **kwargs):
+    """Works like ollama.chat with stream=True, but uses the shared Ollama pool."""
+    return get_pool().chat_stream(model, **kwargs)
+
+
+def embed(model, **kwargs):
+    """Works like ollama.embed, but uses the shared Ollama pool."""
+    return get_pool().embed(model, **kwargs)
@@ -0,0 +1,189 @@
+import logging
+import time
+
+import app_parameters
+from ollama_pool import chat_stream
+
+
+THINK_START = "<think>"
+THINK_END = "</think>"
+
+# Assistant message prefill which makes reasoning models skip thinking
+EMPTY_THINK_PREFILL = f"{THINK_START}\n\n{THINK_END}\n\n"
+
+
+class ThinkStripper:
+    """Splits the streamed model output into the reasoning and the answer part.
+
+    Text inside <think> blocks is reasoning, everything else is the answer.
+    Tags split between chunks are buffered until they can be recognized.
+    """
+
+    def __init__(self):
+        self.in_think = False
+        self.buffer = ""
+
+    def feed(self, text):
+        """Processes the next chunk of the stream.
+
+        Args:
+            text (str): Chunk content.
+
+        Returns:
+            tuple[str, str]: Reasoning and answer text found in the chunk.
+        """
+        text = self.buffer + text
+        self.buffer = ""
+        reasoning = []
+        answer = []
+        while text:
+            tag = THINK_END if self.in_think else THINK_START
+            position = text.find(tag)
+            if position == -1:
+                keep = partial_tag_length(text, tag)
+                self.buffer = text[len(text) - keep :]
+                text = text[: len(text) - keep]
+                (reasoning if self.in_think else answer).append(text)
+                break
+            (reasoning if self.in_think else answer).append(text[:position])
+            text = text[position + len(tag) :]
+            self.in_think = not self.in_think
+        return "".join(reasoning), "".join(answer)
+
+    def flush(self):
+        """Returns the buffered text at the end of the stream.
+
+        Returns:
+            tuple[str, str]: Reasoning and answer text left in the buffer.
+        """
+        text = self.buffer
+        self.buffer = ""
+        return (text, "") if self.in_think else ("", text)
+
+
+def partial_tag_length(text, tag):
+    """Checks how long end of the text may be the beginning of the tag.
+
+    Args:
+        text (str): Streamed text.
+        tag (str): Searched tag.
+
+    Returns:
+        int: Length of the text end matching the tag beginning.
+    """
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+def stream_answer(model, messages, options, reasoning_limit):
+    """Streams the response and stops when reasoning exceeds the limit.
+
+    Args:
+        model (str): Used model.
+        messages (list[dict]): Chat messages.
+        options (dict): Ollama options.
+        reasoning_limit (int | None): Maximum reasoning tokens, None for no limit.
+
+    Returns:
+        tuple[str, str, int, int, bool]: Reasoning, answer, reasoning tokens,
+            answer tokens and True if the reasoning was cut.
+    """
+    stripper = ThinkStripper()
+    reasoning = []
+    answer = []
+    reasoning_tokens = 0
+    answer_tokens = 0
+    stream = chat_stream(model, messages=messages, options=options)
+    try:
+        for chunk in stream:
+            reasoning_part, answer_part = stripper.feed(chunk["message"]["content"])
+            reasoning.append(reasoning_part)
+            answer.append(answer_part)
+            # Ollama streams one token per chunk
+            if stripper.in_think or reasoning_part:
+                reasoning_tokens += 1
+            else:
+                answer_tokens += 1
+            if (
+                reasoning_limit is not None
+                and stripper.in_think
+                and reasoning_tokens >= reasoning_limit
+            ):
+                cut = True
+                break
+        else:
+            cut = False
+            reasoning_part, answer_part = stripper.flush()
+            reasoning.append(reasoning_part)
+            answer.append(answer_part)
+    finally:
+        stream.close()
+    return "".join(reasoning), "".join(answer), reasoning_tokens, answer_tokens, cut
+
+
+def generate_with_reasoning_control(model, messages, options, mode):
+    """Generates the answer of the reasoning model with the limited thinking phase.
+    Think blocks are removed from the stream as it comes.
+
+    Modes:
+        "off" - the answer is prefilled with an empty think block, if the model
+            starts thinking anyway, the answer is generated in the "capped" mode,
+        "capped" - reasoning is stopped after the configured number of tokens
+            and the model is asked to answer using the reasoning so far,
+        "full" - reasoning is not limited.
+
+    Args:
+        model (str): Used model.
+        messages (list[dict]): Chat messages.
+        options (dict): Ollama options, num_predict is the answer budget.
+        mode (str): Reasoning mode.
+
+    Returns:
+        str: Answer without the reasoning.
+    """
+    start = time.monotonic()
+    reasoning_limit = app_parameters.REASONING_LOCAL["max_tokens"]
+    if mode == "off":
+        reasoning, answer, reasoning_tokens, answer_tokens, cut = stream_answer(
+            model,
+            messages + [{"role": "assistant", "content": EMPTY_THINK_PREFILL}],
+            options,
+            0,
+        )
+        if cut:
+            logging.info("Model %s started thinking, using capped reasoning", model)
+            return generate_with_reasoning_control(model, messages, options, "capped")
+    else:
+        if mode == "capped":
+            options = {
+                **options,
+                "num_predict": options["num_predict"] + reasoning_limit,
+            }
+        else:
+            reasoning_limit = None
+        reasoning, answer, reasoning_tokens, answer_tokens, cut = stream_answer(
+            model, messages, options, reasoning_limit
+        )
+    if cut and mode == "capped":
+        logging.info(
+            "Reasoning cut after %s tokens, asking for the answer", reasoning_tokens
+        )
+        prefill = f"{THINK_START}\n{reasoning.strip()}\n{THINK_END}\n\n"
+        options = {**options, "num_predict": options["num_predict"] - reasoning_limit}
+        _, answer, extra_reasoning_tokens, answer_tokens, _ = stream_answer(
+            model,
+            messages + [{"role": "assistant", "content": prefill}],
+            options,
+            0,
+        )
+        reasoning_tokens += extra_reasoning_tokens
+    logging.info(
+        "Model %s: %s reasoning tokens, %s answer tokens, %.2f s",
+        model,
+        reasoning_tokens,
+        answer_tokens,
+        time.monotonic() - start,
+    )
+    return answer.strip()